@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# LoRa time on air and channel occupation.
+# Airtime gives the time on air of a payload with the modulation of the radio, the value of
+# each payload length (0-255 bytes) is computed once when the object is created.
+# ChannelMeter sums the airtime of transmitted and received frames over rolling windows
+# of 1 minute, 10 minutes and 1 hour.
+# DutyCycle is a token bucket of TX airtime enforcing the config.py duty cycle limit.
+
+import math
+import time
+import threading
+from collections import deque
+import config
+from Logger import logf, WARNING
+
+MAX_PAYLOAD = 255
+TX_TIMEOUT_MARGIN = 1.2  # TX timeout is time on air times margin plus TX_TIMEOUT_EXTRA seconds
+TX_TIMEOUT_EXTRA = 0.1
+
+def time_on_air(payloadLength, sf, bw, cr, preamble, explicitHeader=True, crc=True, ldro=False):
+    # LoRa time on air in second, formula from Semtech SX126x datasheet section 6.1.4. cr is the denominator 5..8
+    tSym = (1 << sf) / bw
+    ih = 0 if explicitHeader else 1
+    crc = 1 if crc else 0
+    if sf < 7 :
+        nPayload = math.ceil(max(8 * payloadLength + 16 * crc - 4 * sf + 20 * (1 - ih), 0) / (4 * sf))
+        nSymbol = preamble + 6.25 + 8 + nPayload * cr
+    else :
+        de = 1 if ldro else 0
+        nPayload = math.ceil(max(8 * payloadLength + 16 * crc - 4 * sf + 8 + 20 * (1 - ih), 0) / (4 * (sf - 2 * de)))
+        nSymbol = preamble + 4.25 + 8 + nPayload * cr
+    return nSymbol * tSym
+
+def ldro_auto(sf, bw):
+    # Low Data Rate Optimization is required when the symbol duration exceeds 16ms:
+    # SF=12 and 11 in 125 kHz, SF=12 in 250 kHz
+    return (sf == 12 and bw in (125000, 250000)) or (sf == 11 and bw == 125000)
+
+def ldro_resolve(ldro, sf, bw):
+    # ldro setting of config.py: "" for auto, True/False or "True"/"False" to force it
+    if ldro == "":
+        return ldro_auto(sf, bw)
+    if ldro is True or ldro is False:
+        return ldro
+    if str(ldro).strip().lower() in ("true", "false"):
+        return str(ldro).strip().lower() == "true"
+    logf("Invalid ldro in config.py: " + repr(ldro) + ", using True", WARNING)
+    return True
+
+
+class Airtime:
+    '''Time on air of the configured LoRa modulation, cached per payload length'''
+
+    def __init__(self, sf=None, bw=None, cr=None, preamble=None, crc=None, ldro=None):
+        # parameters default to config.py, explicit header mode is always used by the TNCs
+        self.sf = config.spreadingFactor if sf is None else sf
+        self.bw = config.bandwidth if bw is None else bw
+        self.cr = config.codingrate if cr is None else cr
+        self.preamble = config.preamble if preamble is None else preamble
+        self.crc = config.crc if crc is None else crc
+        if ldro is None:
+            ldro = ldro_resolve(config.ldro, self.sf, self.bw)
+        self.ldro = ldro
+        self.table = [time_on_air(n, self.sf, self.bw, self.cr, self.preamble, True, self.crc, self.ldro) for n in range(MAX_PAYLOAD + 1)]
+
+    def __call__(self, payloadLength):
+        # time on air in second
+        return self.table[min(payloadLength, MAX_PAYLOAD)]
+
+    def tx_timeout(self, payloadLength):
+        # max time waiting for TX done interrupt, in second
+        return self.table[min(payloadLength, MAX_PAYLOAD)] * TX_TIMEOUT_MARGIN + TX_TIMEOUT_EXTRA
+
+
+class ChannelMeter:
+    '''Airtime of transmitted and received frames over rolling windows'''
+
+    WINDOWS = (("1m", 60), ("10m", 600), ("1h", 3600))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # for each window: frames (time, tx airtime, rx airtime) and their sums
+        self.frames = {name: deque() for name, length in self.WINDOWS}
+        self.tx = {name: 0.0 for name, length in self.WINDOWS}
+        self.rx = {name: 0.0 for name, length in self.WINDOWS}
+        self.tx_total = 0.0
+        self.rx_total = 0.0
+
+    def add_tx(self, airtime, now=None):
+        self.add(airtime, 0.0, now)
+
+    def add_rx(self, airtime, now=None):
+        self.add(0.0, airtime, now)
+
+    def add(self, tx, rx, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.tx_total += tx
+            self.rx_total += rx
+            for name, length in self.WINDOWS:
+                self.frames[name].append((now, tx, rx))
+                self.tx[name] += tx
+                self.rx[name] += rx
+            self.expire(now)
+
+    def expire(self, now):
+        for name, length in self.WINDOWS:
+            frames = self.frames[name]
+            while frames and frames[0][0] <= now - length:
+                t, tx, rx = frames.popleft()
+                self.tx[name] -= tx
+                self.rx[name] -= rx
+
+    def utilisation(self, now=None):
+        # fraction of each window the channel was occupied by our TX and by received frames
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.expire(now)
+            return {name: dict(tx=max(self.tx[name], 0.0) / length, rx=max(self.rx[name], 0.0) / length)
+                    for name, length in self.WINDOWS}
+
+
+class DutyCycle:
+    '''Token bucket of TX airtime: refilled at percent/100 second per second, holding at most percent% of window'''
+
+    DEFER = "defer"
+    DROP = "drop"
+
+    def __init__(self, percent=None, window=None, policy=None):
+        self.percent = config.DUTY_CYCLE if percent is None else percent
+        self.window = config.DUTY_CYCLE_WINDOW if window is None else window
+        self.policy = config.DUTY_CYCLE_POLICY if policy is None else policy
+        if self.policy not in (self.DEFER, self.DROP):
+            raise ValueError("Invalid DUTY_CYCLE_POLICY in config.py: " + repr(self.policy))
+        self.rate = self.percent / 100
+        self.capacity = self.rate * self.window
+        self.tokens = self.capacity  # remaining airtime in second, the budget starts full
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.used = 0.0
+        self.deferred = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def budget(self, now=None):
+        # remaining TX airtime in second
+        with self.lock:
+            self.refill(time.monotonic() if now is None else now)
+            return self.tokens
+
+    def wait(self, airtime, now=None):
+        # time in second before airtime can be charged, 0 if it's available now
+        if not self.enabled:
+            return 0.0
+        with self.lock:
+            self.refill(time.monotonic() if now is None else now)
+            return max(airtime - self.tokens, 0.0) / self.rate
+
+    def fits(self, airtime):
+        # a frame longer than the whole budget can never be sent
+        return not self.enabled or airtime <= self.capacity
+
+    def charge(self, airtime, now=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.refill(time.monotonic() if now is None else now)
+            self.tokens -= airtime
+            self.used += airtime
+
+    def stats(self):
+        return dict(
+                percent  = self.percent,
+                capacity = self.capacity,
+                budget   = self.budget() if self.enabled else None,
+                used     = self.used,
+                deferred = self.deferred,
+                dropped  = self.dropped,
+                policy   = self.policy
+            )
+
+
+if __name__ == '__main__':
+    '''Test program'''
+    from timeit import timeit
+    airtime = Airtime()
+    print("SF%d BW%d CR4/%d preamble %d CRC %s LDRO %s" % (airtime.sf, airtime.bw, airtime.cr, airtime.preamble, airtime.crc, airtime.ldro))
+    for n in (10, 50, 100, 255):
+        print("%3d bytes: %7.1fms, TX timeout %7.1fms" % (n, airtime(n) * 1000, airtime.tx_timeout(n) * 1000))
+    # CR4/5 preamble 8 CRC: SF7 BW125 10 bytes = 40.25 symbols of 1.024ms, SF12 BW125 LDRO 50 bytes = 70.25 symbols of 32.768ms
+    assert abs(time_on_air(10, 7, 125000, 5, 8, True, True, False) - 40.25 * 0.001024) < 1e-9
+    assert abs(time_on_air(50, 12, 125000, 5, 8, True, True, True) - 70.25 * 0.032768) < 1e-9
+    assert ldro_resolve("", 12, 125000) and not ldro_resolve("False", 12, 125000) and ldro_resolve("True", 7, 125000) and not ldro_resolve(False, 12, 125000)
+    print("cached %.3fus, computed %.3fus" % (timeit(lambda: airtime(80), number=100000) * 10,
+        timeit(lambda: time_on_air(80, airtime.sf, airtime.bw, airtime.cr, airtime.preamble, True, airtime.crc, airtime.ldro), number=100000) * 10))
+
+    meter = ChannelMeter()
+    for i in range(120): # one 1s frame every 30s for one hour, RX 2s every minute
+        meter.add_tx(1.0, i * 30)
+        if i % 2:
+            meter.add_rx(2.0, i * 30)
+    print(meter.utilisation(3570))
+
+    dutyCycle = DutyCycle(1, 3600, DutyCycle.DEFER) # 36s budget, refilled at 10ms/s
+    t = dutyCycle.updated
+    for i in range(20):
+        dutyCycle.charge(2.0, t)
+    print("budget %.1fs, 1s frame waits %.0fs" % (dutyCycle.budget(t), dutyCycle.wait(1.0, t)))
+    assert abs(dutyCycle.wait(1.0, t) - 500) < 1e-6 and dutyCycle.wait(1.0, t + 500) < 1e-6 and not dutyCycle.fits(40)
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# End to end benchmark of the TNC on the simulated radio (hardware = "sim").
+# The TNC and the KISS server are started like in Start_lora-tnc.py and a KISS client
+# is connected over TCP.
+#   RX: frames are injected in the radio at a fixed rate, latency is measured from
+#       RX done interrupt to complete reception of the KISS frame by the client.
+#       For the SX126x TNC the time spent in the RX callback per frame is reported too.
+#   TX: KISS frames are sent by the client at a fixed rate, latency is measured from
+#       the client write to TX start of the radio.
+# For each rate p50/p99/max latency, process CPU time per frame and lost frames are reported.
+# Each TNC class runs in its own process, results are written to a JSON file.
+#
+# Usage: python3 Benchmark.py [--tnc sx126x|sx127x] [--rates 10,50,200] [--frames 500] [--output benchmark.json] [--compare old.json]
+#
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import config
+
+TNCS = ("sx126x", "sx127x")
+SEQUENCE = re.compile(rb"#(\d{6})")
+SETTLE_TIME = 2.0  # max wait for frames still in flight at the end of a run, in seconds
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, len(samples) * p // 100)]
+
+def summary(rate, sent, latencies, cpu, elapsed):
+    latencies.sort()
+    ms = lambda t: None if t is None else round(t * 1000, 3)
+    return dict(
+            rate         = rate,
+            frames       = sent,
+            delivered    = len(latencies),
+            lost         = sent - len(latencies),
+            throughput   = round(len(latencies) / elapsed, 1),
+            p50_ms       = ms(percentile(latencies, 50)),
+            p99_ms       = ms(percentile(latencies, 99)),
+            max_ms       = ms(latencies[-1] if latencies else None),
+            cpu_ms_frame = round(cpu / sent * 1000, 3)
+        )
+
+def pace(start, i, rate):
+    # sleep until the i-th frame is due
+    delay = start + i / rate - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+class KissClient(threading.Thread):
+    '''TCP KISS client timestamping the frames received from the TNC by sequence number'''
+
+    def __init__(self, host, port):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.received = {}  # sequence number: reception time
+
+    def run(self):
+        data = b""
+        while True:
+            try:
+                chunk = self.sock.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            t = time.perf_counter()
+            data += chunk
+            end = data.rfind(b"\xc0")
+            # sequence numbers of complete frames, the tail waits for the next chunk
+            for match in SEQUENCE.finditer(data, 0, end):
+                self.received.setdefault(int(match.group(1)), t)
+            data = data[end:] if end >= 0 else data
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+def start_tnc(tnc, port):
+    from queue import Queue
+    from TCPServer import KissServer
+    queue = Queue()
+    server = KissServer(queue, "127.0.0.1", port)
+    server.daemon = True
+    server.start()
+    # same parameters of Start_lora-tnc.py
+    if tnc == "sx127x":
+        from LoraAprsKissTnc_sx127x import LoraAprsKissTnc
+        lora = LoraAprsKissTnc(queue, server, config.frequency, config.preamble, config.spreadingFactor, config.bandwidth, config.codingrate, config.crc, config.appendSignalReport, 1, config.outputPower, config.sync_word, config.ldro)
+    else:
+        from LoraAprsKissTnc_sx126x import LoraAprsKissTnc
+        lora = LoraAprsKissTnc(queue, server, config.busId, config.csId, config.resetPin, config.busyPin, config.irqPin, config.txenPin, config.rxenPin,
+                            config.frequency, config.preamble, config.spreadingFactor, config.bandwidth, config.codingrate, config.appendSignalReport,
+                            config.outputPower, config.sync_word, 80, config.crc, config.RX_GAIN_POWER_SAVING, config.ldro)
+    threading.Thread(target=lora.startListening, daemon=True).start()
+    return lora, server
+
+def callback_stats(lora):
+    # RX callback time totals of the TNC, None if it doesn't measure them
+    return lora.callbackStats() if hasattr(lora, "callbackStats") else None
+
+def bench_rx(lora, radio, client, rate, frames, base):
+    # frames injected in the radio, delivered when received by the KISS client
+    injected = {}
+    callback = callback_stats(lora)
+    missed = radio.missed
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(frames):
+        pace(start, i, rate)
+        sequence = base + i
+        injected[sequence] = time.perf_counter()
+        radio.inject(b"<\xff\x01N0CALL-1>APRS,WIDE1-1:>benchmark #%06d" % sequence, rssi=-110, snr=-3.5, freqError=250)
+    deadline = time.perf_counter() + SETTLE_TIME
+    while sum(1 for s in injected if s in client.received) < frames and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    latencies = [client.received[s] - t for s, t in injected.items() if s in client.received]
+    result = summary(rate, frames, latencies, cpu, elapsed)
+    result["missed_by_radio"] = radio.missed - missed  # injected while the radio was not in RX
+    if callback is not None:
+        # mean time per frame of payload read and whole RX callback
+        now = callback_stats(lora)
+        n = now["frames"] - callback["frames"]
+        result["payload_read_ms"] = round((now["read_time"] - callback["read_time"]) / n * 1000, 4) if n else None
+        result["callback_ms"] = round((now["callback_time"] - callback["callback_time"]) / n * 1000, 4) if n else None
+    return result
+
+def bench_tx(radio, client, rate, frames, base):
+    # KISS frames written by the client, delivered when the radio starts TX
+    import KissHelper
+    from Frame import Frame
+    transmitted = {}
+    def onTransmit(payload):
+        match = SEQUENCE.search(payload)
+        if match:
+            transmitted.setdefault(int(match.group(1)), time.perf_counter())
+    radio.onTransmit = onTransmit
+    written = {}
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(frames):
+        pace(start, i, rate)
+        sequence = base + i
+        kiss = KissHelper.encode_kiss_OE(Frame(b"N0CALL-2>APRS:>benchmark #%06d" % sequence, Frame.TX, True))
+        written[sequence] = time.perf_counter()
+        client.send(kiss)
+    deadline = time.perf_counter() + SETTLE_TIME
+    while len(transmitted) < frames and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    radio.onTransmit = None
+    latencies = [transmitted[s] - t for s, t in written.items() if s in transmitted]
+    return summary(rate, frames, latencies, cpu, elapsed)
+
+def run(tnc, rates, frames, port, airtimeScale):
+    # runs in the child process of one TNC class
+    config.hardware = "sim"
+    config.sx127x = tnc == "sx127x"
+    config.log_enable = False
+    import Logger
+    Logger.set_level(Logger.WARNING)
+    import Simulator
+    Simulator.airtimeScale = airtimeScale
+    # the simulated radio needs no external driver, an import error is a failure of the benchmark
+    lora, server = start_tnc(tnc, port)
+    radio = Simulator.radio()
+    client = KissClient("127.0.0.1", port)
+    client.start()
+    time.sleep(0.2)
+    result = dict(rx=[], tx=[])
+    base = 0
+    for rate in rates:
+        result["rx"].append(bench_rx(lora, radio, client, rate, frames, base))
+        base += frames
+    for rate in rates:
+        result["tx"].append(bench_tx(radio, client, rate, frames, base))
+        base += frames
+    result["server"] = server.stats()
+    result["scheduler"] = lora.scheduler.stats()
+    client.close()
+    return result
+
+def compare(old, new):
+    # p50/p99 change against a previous result file
+    for tnc, result in new["results"].items():
+        previous = old.get("results", {}).get(tnc, {})
+        for phase in ("rx", "tx"):
+            before = {r["rate"]: r for r in previous.get(phase, [])}
+            for r in result.get(phase, []):
+                b = before.get(r["rate"])
+                if not b:
+                    continue
+                change = lambda key: "%+.0f%%" % ((r[key] / b[key] - 1) * 100) if r.get(key) and b.get(key) else "n/a"
+                callback = ", RX callback %s" % change("callback_ms") if "callback_ms" in r else ""
+                print("%s %s %5d/s: p50 %s p99 %s lost %d -> %d%s" % (tnc, phase.upper(), r["rate"], change("p50_ms"), change("p99_ms"), b["lost"], r["lost"], callback))
+
+def report(results):
+    for tnc, result in results.items():
+        if "failed" in result:
+            print("%s: failed (%s)" % (tnc, result["failed"]))
+            continue
+        for phase in ("rx", "tx"):
+            for r in result[phase]:
+                callback = ", RX callback %.3fms (payload read %.3fms)" % (r["callback_ms"], r["payload_read_ms"]) if r.get("callback_ms") is not None else ""
+                print("%s %s %5d/s: p50 %7.3fms p99 %7.3fms max %7.3fms, %6.3fms CPU/frame, %d/%d lost%s" % (
+                    tnc, phase.upper(), r["rate"], r["p50_ms"] or 0, r["p99_ms"] or 0, r["max_ms"] or 0, r["cpu_ms_frame"], r["lost"], r["frames"], callback))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End to end TNC benchmark on the simulated radio")
+    parser.add_argument("--tnc", choices=TNCS, help="benchmark only this TNC class")
+    parser.add_argument("--rates", default="10,50,200,1000", help="frames per second, comma separated")
+    parser.add_argument("--frames", type=int, default=500, help="frames for each rate")
+    parser.add_argument("--airtime-scale", type=float, default=0.0, help="simulated time on air multiplier, 0 = TX without airtime")
+    parser.add_argument("--port", type=int, default=10101)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="previous result file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    rates = [int(r) for r in args.rates.split(",")]
+
+    if args.child:
+        with open(args.output, "w") as f:
+            json.dump(run(args.tnc, rates, args.frames, args.port, args.airtime_scale), f)
+        sys.stdout.flush()
+        os._exit(0) # TNC threads don't stop
+
+    results = {}
+    for i, tnc in enumerate([args.tnc] if args.tnc else TNCS):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--tnc", tnc, "--rates", args.rates, "--frames", str(args.frames),
+                        "--airtime-scale", str(args.airtime_scale), "--port", str(args.port + i), "--output", path],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+        try:
+            with open(path) as f:
+                results[tnc] = json.load(f)
+        except ValueError:
+            results[tnc] = dict(failed="benchmark process exited with status %d" % child.returncode)
+        os.remove(path)
+
+    output = dict(
+            date     = time.strftime("%Y-%m-%dT%H:%M:%S"),
+            host     = platform.node(),
+            python   = platform.python_version(),
+            machine  = platform.machine(),
+            settings = dict(rates=rates, frames=args.frames, airtime_scale=args.airtime_scale),
+            lora     = dict(sf=config.spreadingFactor, bw=config.bandwidth, cr=config.codingrate, preamble=config.preamble),
+            results  = results
+        )
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=1)
+    report(results)
+    print("Results written to " + args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+    if any("failed" in result for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Frame passed between radio, KISS server and TX scheduler.
+# RX: created by the TNC callback with the signal metrics, encoded by the KISS server.
+# TX: created by the KISS server from the decoded KISS frame, queued, sent by the TNC.
+# The information field offset and the signal report are computed once, on first use.
+
+import time
+
+LORA_APRS_HEADER = b"<\xff\x01"
+
+class Frame:
+    '''APRS frame as OE_Style text (without LoRa APRS header) or standard AX25 packet'''
+
+    RX = "RX"
+    TX = "TX"
+
+    __slots__ = ('data', 'direction', 'oe', 'rssi', 'snr', 'freqError', 'timestamp', 'sent', '_infoOffset', '_signalReport')
+
+    def __init__(self, data, direction, oe, rssi=None, snr=None, freqError=None):
+        self.data = data              # bytes, OE_Style text or AX25 packet
+        self.direction = direction    # Frame.RX or Frame.TX
+        self.oe = oe                  # True if data is OE_Style text
+        self.rssi = rssi              # dBm, RX only
+        self.snr = snr                # dB, RX only
+        self.freqError = freqError    # Hz, RX only
+        self.timestamp = time.monotonic() # reception from radio (RX) or from KISS client (TX)
+        self.sent = None              # TX start, set by the TX scheduler
+        self._infoOffset = None
+        self._signalReport = None
+
+    @classmethod
+    def fromRadio(cls, payload, rssi, snr, freqError):
+        # OE_Style frames are recognized by the LoRa APRS header, which is removed
+        if payload[0:len(LORA_APRS_HEADER)] == LORA_APRS_HEADER:
+            return cls(payload[len(LORA_APRS_HEADER):], cls.RX, True, rssi, snr, freqError)
+        return cls(payload, cls.RX, False, rssi, snr, freqError)
+
+    @property
+    def infoOffset(self):
+        # offset of the information field (APRS payload) in data
+        if self._infoOffset is None:
+            data = self.data
+            if self.oe:
+                self._infoOffset = data.find(b":") + 1
+            else:
+                # the last address has the extension bit set, then control and PID bytes follow
+                pos = 13
+                while pos < len(data) and not data[pos] & 0x01:
+                    pos += 7
+                self._infoOffset = pos + 3
+        return self._infoOffset
+
+    @property
+    def dti(self):
+        # APRS data type identifier, first byte of the information field
+        offset = self.infoOffset
+        return self.data[offset:offset + 1]
+
+    @property
+    def signalReport(self):
+        if self._signalReport is None and self.rssi is not None:
+            self._signalReport = "Level:"+str(self.rssi)+" dBm, SNR:"+str(self.snr)+"dB"
+        return self._signalReport
+
+    @property
+    def latency(self):
+        # time from KISS reception to TX start, in seconds
+        if self.sent is None:
+            return None
+        return self.sent - self.timestamp
+
+    def onAir(self):
+        # bytes to be transmitted
+        if self.oe:
+            return LORA_APRS_HEADER + self.data
+        return self.data
+
+    def __repr__(self):
+        return "Frame(%s, %s, %r)" % (self.direction, "OE" if self.oe else "AX25", self.data)
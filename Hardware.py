@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# SPI and GPIO backend used by the radio drivers (SX126x.py, LoRa.py and board_config.py).
+# config.hardware selects the backend:
+#   "rpi": spidev and RPi.GPIO on the Raspberry Pi
+#   "sim": simulated radio of Simulator.py, for tests and benchmarks on any host
+# Both backends export gpio, with the RPi.GPIO API, and SpiDev, with the spidev.SpiDev API.
+
+import config
+
+backend = config.hardware
+
+if backend == "sim":
+    import Simulator
+    gpio = Simulator.gpio
+    SpiDev = Simulator.SpiDev
+elif backend == "rpi":
+    import RPi.GPIO as gpio
+    from spidev import SpiDev
+else:
+    raise ValueError("Unknown hardware backend in config.py: " + repr(backend))
@@ -27,70 +27,135 @@
 #   KISS-TNC for LoRa radio modem
 #   https://github.com/IZ7BOJ/RPi-LoRa-KISS-TNC
 
-import struct
-import datetime
+import time
+import functools
+from collections import namedtuple
 import config
+from Logger import logf, log_enabled, DEBUG, ERROR
 
 KISS_FEND = 0xC0  # Frame start/end marker
 KISS_FESC = 0xDB  # Escape character
 KISS_TFEND = 0xDC  # If after an escape, means there was an 0xC0 in the source message
 KISS_TFESC = 0xDD  # If after an escape, means there was an 0xDB in the source message
 
+# KISS commands, low nibble of the type byte. High nibble is the TNC port
+KISS_CMD_DATA = 0x00
+KISS_CMD_TXDELAY = 0x01  # keyup delay in 10ms units
+KISS_CMD_P = 0x02  # persistence, transmit probability is (P+1)/256
+KISS_CMD_SLOTTIME = 0x03  # slot time in 10ms units
+KISS_CMD_TXTAIL = 0x04  # obsolete
+KISS_CMD_FULLDUPLEX = 0x05  # 0 half duplex, otherwise full duplex
+KISS_CMD_SETHARDWARE = 0x06  # TNC specific
+KISS_CMD_RETURN = 0xFF  # exit KISS mode, whole type byte
+
+# Escape sequences as bytes, for C-level replace()
+_FEND = bytes([KISS_FEND])
+_FESC = bytes([KISS_FESC])
+_FESC_TFEND = bytes([KISS_FESC, KISS_TFEND])
+_FESC_TFESC = bytes([KISS_FESC, KISS_TFESC])
+
 # APRS data types
 DATA_TYPES_POSITION = b"!'/@`"
 DATA_TYPE_MESSAGE = b":"
 DATA_TYPE_THIRD_PARTY = b"}"
 
-def logf(message):
-    timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
-    if config.log_enable:
-       fileLog = open(config.logpath,"a")
-       fileLog.write(timestamp + message+"\n")
-       fileLog.close()
-    print(timestamp + message)
+# AX25 address decoding cache, keyed on the raw 7 address bytes.
+# Repeated stations cost a dictionary lookup instead of a decode.
+ADDRESS_CACHE_SIZE = 1024
+# translation table shifting every byte right by 1, for callsign decoding
+_SHIFT_RIGHT = bytes(x >> 1 for x in range(256))
+
+# Fields extracted by ax25parser. rpt_list is the digipeater path as b",DIGI1,DIGI2"
+AX25Fields = namedtuple("AX25Fields", "src_addr dest_addr rpt_list pid payload dti")
 
 # from LoRa OE_Style to KISS
 # Addresses must be 6 bytes plus the SSID byte, each character shifted left by 1
 # If it's the final address in the header, set the low bit to 1
 # If it has been digipeated, set the H bit to 1
 # Ignoring command/response for simple example
+# Returns the 7 bytes address block, raises ValueError on invalid callsign or SSID
 def encode_address(s, final):
-    H=0b00000000 #default H bit low
-    if chr(s[-1])=='*': #example: WIDE1-1* or WIDE1*
+    H=False #default H bit low
+    if s[-1:]==b'*': #example: WIDE1-1* or WIDE1*
         s=s[:-1]
-        H=0b10000000
+        H=True
+    return _encode_address(s, final, H)
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _encode_address(s, final, H):
+    s = s.upper()
     if b"-" not in s:
         s = s + b"-0"  # default to SSID 0
     call, ssid = s.split(b'-')
-    if len(call) < 6:
-        call = call + b" "*(6 - len(call)) # pad with spaces
-    encoded_call = [x << 1 for x in call[0:6]]
-    encoded_ssid = (int(ssid) << 1) | H | 0b01100000 | (0b00000001 if final else 0)
-    return encoded_call + [encoded_ssid]
+    call = call[0:6].ljust(6) # pad with spaces
+    encoded_ssid = (int(ssid) << 1) | (0b10000000 if H else 0) | 0b01100000 | (0b00000001 if final else 0)
+    return bytes([x << 1 for x in call] + [encoded_ssid])
+
+
+def kiss_escape(data): #escape FEND and FESC bytes in data, returns bytes
+    # FESC must be escaped first, otherwise the FESC of the FEND escape sequence would be escaped again
+    return bytes(data).replace(_FESC, _FESC_TFESC).replace(_FEND, _FESC_TFEND)
+
+def kiss_unescape(data): #reverse of kiss_escape, returns bytes
+    # in escaped data every FESC starts a two bytes sequence, and replacing FESC TFEND can't create a new FESC TFESC
+    return bytes(data).replace(_FESC_TFEND, _FEND).replace(_FESC_TFESC, _FESC)
+
+def kiss_data_frame(packet): #KISS data frame for TNC 0 from an unescaped AX25 packet, returns bytearray
+    kiss_cmd = 0x00  # Two nybbles combined - TNC 0, command 0 (send data)
+    output = bytearray((KISS_FEND, kiss_cmd))
+    output += kiss_escape(packet)
+    output.append(KISS_FEND)
+    return output
 
+def kiss_type(frame): #type byte of a KISS frame including FENDs, and offset of the data following it
+    if frame[1] == KISS_FESC: # escaped type byte, only possible for ports 12 and 13
+        return (KISS_FEND if frame[2] == KISS_TFEND else KISS_FESC), 3
+    return frame[1], 2
 
-def decode_address(data, cursor):
-    (a1, a2, a3, a4, a5, a6, a7) = struct.unpack("<BBBBBBB", data[cursor:cursor + 7])
+def decode_address(data, cursor): #data is bytes or a memoryview on the frame, returns (call, hrr, ext)
+    return _decode_raw_address(bytes(data[cursor:cursor + 7]))
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _decode_raw_address(raw):
+    # the same tuple object is returned for repeated addresses
+    a7 = raw[6]
     hrr = a7 >> 5
     ssid = (a7 >> 1) & 0xf
     ext = a7 & 0x1
-    addr = struct.pack("<BBBBBB", a1 >> 1, a2 >> 1, a3 >> 1, a4 >> 1, a5 >> 1, a6 >> 1)
+    addr = raw[:6].translate(_SHIFT_RIGHT)
     if ssid != 0:
-        call = addr.strip() + "-{}".format(ssid).encode()
+        call = addr.strip() + b"-%d" % ssid
     else:
         call = addr
     return (call, hrr, ext)
 
-def ax25parser(frame): #extracts fields from ax25 frames and add signal report do payload, if specified
+def _cache_stats(cached):
+    info = cached.cache_info()
+    lookups = info.hits + info.misses
+    return dict(
+            hits     = info.hits,
+            misses   = info.misses,
+            hit_rate = info.hits / lookups if lookups else 0.0,
+            size     = info.currsize
+        )
+
+def address_cache_stats(): #hits, misses, hit rate and size of the address decoding and encoding caches
+    return dict(
+            decode = _cache_stats(_decode_raw_address),
+            encode = _cache_stats(_encode_address)
+        )
+
+def ax25parser(frame): #extracts fields from ax25 UI frames, returns AX25Fields or None
     pos = 0
+    header = memoryview(frame) # addresses are decoded without slicing copies of the frame
 
     # DST
-    (dest_addr, dest_hrr, dest_ext) = decode_address(frame, pos)
+    (dest_addr, dest_hrr, dest_ext) = decode_address(header, pos)
     pos += 7
     #print("DST: ", dest_addr)
 
     # SRC
-    (src_addr, src_hrr, src_ext) = decode_address(frame, pos)
+    (src_addr, src_hrr, src_ext) = decode_address(header, pos)
     pos += 7
     #print("SRC: ", src_addr)
 
@@ -98,7 +163,7 @@ def ax25parser(frame): #extracts fields from ax25 frames and add signal report d
     ext = src_ext
     rpt_list = b""
     while ext == 0:
-        rpt_addr, rpt_hrr, ext = decode_address(frame, pos)
+        rpt_addr, rpt_hrr, ext = decode_address(header, pos)
         if rpt_hrr==b'111': # H bit high-->packet has been digipeated
            rpt_addr+=b'*'
         rpt_list += b","+rpt_addr
@@ -115,167 +180,164 @@ def ax25parser(frame): #extracts fields from ax25 frames and add signal report d
         pos += 1
     elif (ctrl & 0x3) == 0x1:
         # decode_sframe(ctrl, frame, pos)
-        logf("SFRAME")
+        logf("SFRAME", DEBUG)
         return None
     elif (ctrl & 0x1) == 0x0:
         # decode_iframe(ctrl, frame, pos)
-        logf("IFRAME")
+        logf("IFRAME", DEBUG)
         return None
     payload=frame[pos:]
-    dti=bytes(chr(payload[0]),'utf-8')
-    logf("Extracted AX25 parameters from AX25 Frame")
-    logf("From: "+repr(src_addr)[2:-1]+" To: "+repr(dest_addr)[2:-1]+" Via: "+repr(rpt_list)[3:-1]+" PID: "+str(hex(pid))+" Payload: "+str(payload)[str(payload).find("'"):-1])
+    dti=payload[0:1]
 
-    return src_addr,dest_addr,rpt_list,payload, dti
+    return AX25Fields(src_addr, dest_addr, rpt_list, pid, payload, dti)
 
-def encode_kiss_AX25(frame,signalreport): #from Lora to Kiss, Standard AX25
+def format_ax25(fields): #human readable rendering of AX25Fields, for logging
+    return ("From: "+repr(fields.src_addr)[2:-1]+" To: "+repr(fields.dest_addr)[2:-1]+" Via: "+repr(fields.rpt_list)[3:-1]+
+            " PID: "+str(hex(fields.pid))+" Payload: "+str(fields.payload)[str(fields.payload).find("'"):-1])
 
-    src_addr,dest_addr,rpt_list,payload,dti=ax25parser(frame) #only for logging
+def log_ax25(frame, origin): #full parse of the frame only when debug logging is enabled
+    if not log_enabled(DEBUG):
+        return
+    fields = ax25parser(frame)
+    if fields is not None:
+        logf("Extracted AX25 parameters from "+origin, DEBUG)
+        logf(format_ax25(fields), DEBUG)
 
-    # Escape the packet in case either KISS_FEND or KISS_FESC ended up in our stream
-    if config.appendSignalReport and dti != DATA_TYPE_MESSAGE:
-        frame += b" "+str.encode(signalreport,'utf-8')
+def encode_kiss_AX25(frame): #from Lora to Kiss, Standard AX25. frame is a Frame received from radio
 
-    packet_escaped = []
-    for x in frame:
-        if x == KISS_FEND:
-            packet_escaped += [KISS_FESC, KISS_TFEND]
-        elif x == KISS_FESC:
-            packet_escaped += [KISS_FESC, KISS_TFESC]
-        else:
-            packet_escaped += [x]
+    packet = frame.data
+    log_ax25(packet, "AX25 Frame")
 
-    # Build the frame that we will send to aprx and turn it into a string
-    kiss_cmd = 0x00  # Two nybbles combined - TNC 0, command 0 (send data)
-    kiss_frame = [KISS_FEND, kiss_cmd] + packet_escaped + [KISS_FEND]
+    if config.appendSignalReport and frame.signalReport and frame.dti != DATA_TYPE_MESSAGE:
+        packet += b" "+str.encode(frame.signalReport,'utf-8')
 
-    try:
-        output = bytearray(kiss_frame)
-    except ValueError:
-        logf("Invalid value in frame.")
-        return None
-    return output
+    # Build the frame that we will send to aprx, escaping KISS_FEND or KISS_FESC in our stream
+    return kiss_data_frame(packet)
 
-def encode_kiss_OE(frame,signalreport): #from Lora to Kiss, OE_Style
+def encode_kiss_OE(frame): #from Lora to Kiss, OE_Style. frame is a Frame received from radio
     # Ugly frame disassembling
-    if not b":" in frame:
-        logf("Can't decode OE LoRa Frame")
+    offset = frame.infoOffset
+    if offset == 0:
+        logf("Can't decode OE LoRa Frame", ERROR)
         return None
-    path = frame.split(b":")[0]
-    payload = frame[frame.find(b":")+1:]
-    dti = bytes(chr(payload[0]),'utf-8')
+    path = frame.data[:offset - 1]
+    payload = frame.data[offset:]
+    dti = frame.dti
     src_addr = path.split(b">")[0]
     digis = path[path.find(b">") + 1:].split(b",")
     dest_addr = digis.pop(0)
 
-    # destination address
-    packet = encode_address(dest_addr.upper(), False)
-    # source address
-    packet += encode_address(src_addr.upper(), len(digis) == 0)
-    # digipeaters
-    for digi in digis:
-        final_addr = digis.index(digi) == len(digis) - 1
-        packet += encode_address(digi.upper(), final_addr)
-    # control field
-    packet += [0x03]  # This is an UI frame
-    # protocol ID
-    packet += [0xF0]  # No protocol
-    # information field
-    logf("Extracted AX25 parameters from OE LoRa Frame")
-    logf("From: "+repr(src_addr)[2:-1]+" To: "+repr(dest_addr)[2:-1]+" Via: "+str(digis)[1:-1].replace("b","").replace("'","")+" Payload: "+repr(payload)[2:-1])
-    packet += payload
-    if config.appendSignalReport and dti != DATA_TYPE_MESSAGE:
-        #some SW (es OE5BPA) append newline character at the end of packet. Must be cut for appending signal report
-        if chr(packet[-1])=="\n":
-          packet=packet[:-1]
-        packet += b" "+str.encode(signalreport,'utf-8')
-
-    # Escape the packet in case either KISS_FEND or KISS_FESC ended up in our stream
-    packet_escaped = []
-    for x in packet:
-        if x == KISS_FEND:
-            packet_escaped += [KISS_FESC, KISS_TFEND]
-        elif x == KISS_FESC:
-            packet_escaped += [KISS_FESC, KISS_TFESC]
-        else:
-            packet_escaped += [x]
-
-    # Build the frame that we will send to Dire Wolf and turn it into a string
-    kiss_cmd = 0x00  # Two nybbles combined - TNC 0, command 0 (send data)
-    kiss_frame = [KISS_FEND, kiss_cmd] + packet_escaped + [KISS_FEND]
+    last = len(digis) - 1
     try:
-        #print(bytearray(kiss_frame).hex())
-        output = bytearray(kiss_frame)
+        # destination address, source address and digipeaters, the last one has the final bit
+        packet = bytearray(b"".join([encode_address(dest_addr, False), encode_address(src_addr, last < 0)] +
+                                    [encode_address(digi, i == last) for i, digi in enumerate(digis)]))
     except ValueError:
-        logf("Invalid value in frame.")
+        logf("Invalid value in frame.", ERROR)
         return None
-    return output
+    # control field: this is an UI frame, protocol ID: no protocol
+    packet += b"\x03\xf0"
+    # information field
+    if log_enabled(DEBUG):
+        logf("Extracted AX25 parameters from OE LoRa Frame", DEBUG)
+        logf("From: "+repr(src_addr)[2:-1]+" To: "+repr(dest_addr)[2:-1]+" Via: "+str(digis)[1:-1].replace("b","").replace("'","")+" Payload: "+repr(payload)[2:-1], DEBUG)
+    packet += payload
+    if config.appendSignalReport and frame.signalReport and dti != DATA_TYPE_MESSAGE:
+        #some SW (es OE5BPA) append newline character at the end of packet. Must be cut for appending signal report
+        if packet[-1:]==b"\n":
+          del packet[-1]
+        packet += b" "+str.encode(frame.signalReport,'utf-8')
+
+    # Build the frame that we will send to Dire Wolf, escaping KISS_FEND or KISS_FESC in our stream
+    return kiss_data_frame(packet)
 
 def decode_kiss_OE(frame): #From Kiss to LoRa, OE_Style
 
     if frame[0] != 0xC0 or frame[len(frame) - 1] != 0xC0:
-        logf("Kiss Header not found, abort decoding of Frame: "+repr(frame))
+        logf("Kiss Header not found, abort decoding of Frame: "+repr(frame), ERROR)
+        return None
+    if frame[1] != KISS_CMD_DATA:
+        logf("Not a KISS data frame for port 0, abort decoding of Frame: "+repr(frame), ERROR)
         return None
-    frame=frame[2:len(frame) - 1] #cut kiss delimitator 0xc0 and command 0x00
+    frame=kiss_unescape(frame[2:len(frame) - 1]) #cut kiss delimitator 0xc0 and command 0x00
 
-    src_addr,dest_addr,rpt_list,payload,dti=ax25parser(frame) #only for logging
+    fields = ax25parser(frame)
+    if fields is None:
+        logf("Not an UI frame, abort decoding of Frame: "+repr(frame), ERROR)
+        return None
+    if log_enabled(DEBUG):
+        logf("Extracted AX25 parameters from AX25 Frame", DEBUG)
+        logf(format_ax25(fields), DEBUG)
 
     #build OE_style frame piece by piece
-    result = src_addr.strip()+b">"+dest_addr.strip()+rpt_list+b":"+payload
+    result = fields.src_addr.strip()+b">"+fields.dest_addr.strip()+fields.rpt_list+b":"+fields.payload
     return result
 
 def decode_kiss_AX25(frame): #from kiss to LoRA, Standard AX25
     result = b""
 
     if frame[0] != 0xC0 or frame[len(frame) - 1] != 0xC0:
-        logf("Kiss Header not found, abort decoding of Frame: "+repr(frame))
+        logf("Kiss Header not found, abort decoding of Frame: "+repr(frame), ERROR)
+        return None
+    if frame[1] != KISS_CMD_DATA:
+        logf("Not a KISS data frame for port 0, abort decoding of Frame: "+repr(frame), ERROR)
         return None
-    frame=frame[2:len(frame) - 1] #cut kiss delimitator 0xc0 and command 0x00
+    frame=kiss_unescape(frame[2:len(frame) - 1]) #cut kiss delimitator 0xc0 and command 0x00
 
-    src_addr,dest_addr,rpt_list,payload,dti=ax25parser(frame) #only for logging
+    log_ax25(frame, "AX25 Frame")
 
     return frame
 
 
 class SerialParser():
     '''Simple parser for KISS frames. It handles multiple frames in one packet
-    and calls the callback function on each frame'''
-    STATE_IDLE = 0
-    STATE_FEND = 1
-    STATE_DATA = 2
+    and frames split over several packets, and calls the callback function on each frame.
+    Frames are passed to the callback as bytes, including the leading and trailing FEND'''
     KISS_FEND = KISS_FEND
+    MAX_FRAME_LENGTH = 4096  # partial frame is dropped when longer than this
 
     def __init__(self, frame_cb=None):
         self.frame_cb = frame_cb
         self.reset()
 
     def reset(self):
-        self.state = self.STATE_IDLE
-        self.cur_frame = bytearray()
+        # buffer starts with the FEND opening the current frame, once synchronized
+        self.buffer = bytearray()
+        self.synced = False
+        self.scanned = 1
 
     def parse(self, data):
         #Call parse with a string of one or more characters
-        for c in data:
-            if self.state == self.STATE_IDLE:
-                if c == self.KISS_FEND:
-                    self.cur_frame.append(c)
-                    self.state = self.STATE_FEND
-            elif self.state == self.STATE_FEND:
-                if c == self.KISS_FEND:
-                    self.reset()
-                else:
-                    self.cur_frame.append(c)
-                    self.state = self.STATE_DATA
-            elif self.state == self.STATE_DATA:
-                self.cur_frame.append(c)
-                if c == self.KISS_FEND:
-                    # frame complete
-                    if self.frame_cb:
-                        self.frame_cb(self.cur_frame)
-                    self.reset()
+        buf = self.buffer
+        buf += data
+        if not self.synced:
+            start = buf.find(self.KISS_FEND)
+            if start < 0:
+                # no frame start yet, discard
+                buf.clear()
+                return
+            del buf[:start]
+            self.synced = True
+            self.scanned = 1
+        # locate frame boundaries with find(), only on the data not scanned yet
+        start = 0
+        end = buf.find(self.KISS_FEND, self.scanned)
+        while end >= 0:
+            # consecutive FENDs delimit an empty frame, it is skipped
+            if end > start + 1 and self.frame_cb:
+                self.frame_cb(bytes(buf[start:end + 1]))
+            start = end
+            end = buf.find(self.KISS_FEND, start + 1)
+        # keep last FEND and partial frame for the next packet
+        if start:
+            del buf[:start]
+        self.scanned = len(buf)
+        if self.scanned > self.MAX_FRAME_LENGTH:
+            self.reset()
 
 if __name__ == "__main__":
     # Playground for testing
+    from Frame import Frame, LORA_APRS_HEADER
 
     kissframe = b"\xc0\x00\x82\xa0\xa4\xa6@@`\x9e\x8ar\xa8\x96\x90p\x88\x92\x8e\x92@@f\x88\x92\x8e\x92@@e\x03\xf0!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V\xc0"
 
@@ -287,9 +349,51 @@ if __name__ == "__main__":
 
     #test encode OE->KISS
     OE_frame = b"OE9TKH-8>APRS,digi-3,digi-2:!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V\n"
-    signalreport="Level:-115dBm, SNR:0dB"
-    print(encode_kiss_OE(OE_frame,signalreport))
+    print(encode_kiss_OE(Frame.fromRadio(LORA_APRS_HEADER+OE_frame, -115, 0, 0)))
+
+    #repeated digipeater: only the last one has the final bit
+    print(decode_kiss_OE(encode_kiss_OE(Frame.fromRadio(LORA_APRS_HEADER+b"OE9TKH-8>APRS,WIDE1-1,WIDE1-1:>test", -115, 0, 0))))
 
     #test encode AX25->KISS
     ax25_frame = b"\x82\xa0\xa4\xa6@@`\x9e\x8ar\xa8\x96\x90p\x88\x92\x8e\x92@@f\x88\x92\x8e\x92@@e\x03\xf0!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V\n"
-    print(encode_kiss_AX25(ax25_frame,signalreport))
+    print(encode_kiss_AX25(Frame.fromRadio(ax25_frame, -115, 0, 0)))
+
+    #parser on frames split at every position, with garbage before the first frame and double FENDs
+    frames = []
+    stream = b"garbage" + kissframe + b"\xc0" + kissframe + kissframe
+    for cut in range(len(stream)):
+        parser = SerialParser(frames.append)
+        parser.parse(stream[:cut])
+        parser.parse(stream[cut:])
+        assert frames == [kissframe] * 3, (cut, frames)
+        frames.clear()
+    print("SerialParser split frames OK")
+
+    #escape/unescape round trip on random data, with FEND and FESC frequent
+    import random
+    for i in range(2000):
+        data = bytes(random.choice((KISS_FEND, KISS_FESC, KISS_TFEND, KISS_TFESC, random.randrange(256))) for j in range(random.randrange(300)))
+        escaped = kiss_escape(data)
+        assert KISS_FEND not in escaped and kiss_unescape(escaped) == data
+    print("kiss_escape/kiss_unescape round trip OK")
+
+    #escaping throughput for realistic APRS payload sizes
+    for size in (50, 100, 200, 255):
+        data = bytes(random.randrange(256) for j in range(size))
+        t = time.perf_counter()
+        for i in range(10000):
+            kiss_unescape(kiss_escape(data))
+        print("escape+unescape %3i bytes %6.2f us" % (size, (time.perf_counter() - t) / 10000 * 1e6))
+
+    #codec throughput per frame, at configured log level. Encoding includes the Frame creation
+    n = 10000
+    OE_payload = LORA_APRS_HEADER + OE_frame
+    for name, func in (("decode_kiss_OE", lambda: decode_kiss_OE(kissframe)),
+                       ("decode_kiss_AX25", lambda: decode_kiss_AX25(kissframe)),
+                       ("encode_kiss_OE", lambda: encode_kiss_OE(Frame.fromRadio(OE_payload, -115, 0, 0))),
+                       ("encode_kiss_AX25", lambda: encode_kiss_AX25(Frame.fromRadio(ax25_frame, -115, 0, 0)))):
+        t = time.perf_counter()
+        for i in range(n):
+            func()
+        print("%-18s %6.2f us/frame" % (name, (time.perf_counter() - t) / n * 1e6))
+    print("address cache: " + str(address_cache_stats()))
@@ -22,8 +22,13 @@
 
 
 import sys
-from .constants import *
-from .board_config import BOARD
+try:
+    from .constants import *
+    from .board_config import BOARD
+except ImportError:
+    # imported as a top level module, e.g. with the simulated radio: constants.py and board_config.py of this repository
+    from constants import *
+    from board_config import BOARD
 
 
 ################################################## Some utility functions ##############################################
@@ -53,7 +58,7 @@ def getter(register_address):
     """
     def decorator(func):
         def wrapper(self):
-            return func(self, self.spi.xfer([register_address, 0])[1])
+            return func(self, self._xfer([register_address, 0])[1])
         return wrapper
     return decorator
 
@@ -67,7 +72,7 @@ def setter(register_address):
     """
     def decorator(func):
         def wrapper(self, val):
-            return self.spi.xfer([register_address | 0x80, func(self, val)])[1]
+            return self._xfer([register_address | 0x80, func(self, val)])[1]
         return wrapper
     return decorator
 
@@ -78,6 +83,16 @@ class LoRa(object):
 
     spi = BOARD.SpiDev()              # init and get the baord's SPI
     mode = None                       # the mode is backed up here
+    shadow = None                     # write-through shadow of the configuration registers {address: value}
+    # registers changed by the chip itself: never shadowed
+    volatile_registers = frozenset([
+        REG.LORA.FIFO, REG.LORA.OP_MODE, REG.LORA.FIFO_ADDR_PTR, REG.LORA.FIFO_RX_CURR_ADDR, REG.LORA.IRQ_FLAGS,
+        REG.LORA.RX_NB_BYTES, REG.LORA.RX_HEADER_CNT_MSB, REG.LORA.RX_HEADER_CNT_MSB + 1,
+        REG.LORA.RX_PACKET_CNT_MSB, REG.LORA.RX_PACKET_CNT_MSB + 1, REG.LORA.MODEM_STAT, REG.LORA.PKT_SNR_VALUE,
+        REG.LORA.PKT_RSSI_VALUE, REG.LORA.RSSI_VALUE, REG.LORA.HOP_CHANNEL, REG.LORA.FIFO_RX_BYTE_ADDR,
+        REG.LORA.FEI_MSB, REG.LORA.FEI_MSB + 1, REG.LORA.FEI_MSB + 2,
+        0x2C,                         # RegRssiWideband
+    ])
     backup_registers = []
     verbose = True
     dio_mapping = [None] * 6          # store the dio mapping here
@@ -207,7 +222,7 @@ class LoRa(object):
         """ Get the mode
         :return:    New mode
         """
-        self.mode = self.spi.xfer([REG.LORA.OP_MODE, 0])[1]
+        self.mode = self._xfer([REG.LORA.OP_MODE, 0])[1]
         return self.mode
 
     def set_mode(self, mode):
@@ -220,8 +235,11 @@ class LoRa(object):
             return mode
         if self.verbose:
             sys.stderr.write("Mode <- %s\n" % MODE.lookup[mode])
+        if self.mode is None or (mode ^ self.mode) & 0x80:
+            # switching between LoRa and FSK register files: the shadow is not valid anymore
+            self.shadow = {}
         self.mode = mode
-        return self.spi.xfer([REG.LORA.OP_MODE | 0x80, mode])[1]
+        return self._xfer([REG.LORA.OP_MODE | 0x80, mode])[1]
 
     def write_payload(self, payload):
         """ Get FIFO ready for TX: Set FifoAddrPtr to FifoTxBaseAddr. The transceiver is put into STDBY mode.
@@ -234,7 +252,7 @@ class LoRa(object):
         self.set_mode(MODE.STDBY)
         base_addr = self.get_fifo_tx_base_addr()
         self.set_fifo_addr_ptr(base_addr)
-        return self.spi.xfer([REG.LORA.FIFO | 0x80] + payload)[1:]
+        return self._xfer([REG.LORA.FIFO | 0x80] + payload)[1:]
 
     def reset_ptr_rx(self):
         """ Get FIFO ready for RX: Set FifoAddrPtr to FifoRxBaseAddr. The transceiver is put into STDBY mode. """
@@ -261,15 +279,65 @@ class LoRa(object):
         rx_nb_bytes = self.get_rx_nb_bytes()
         fifo_rx_current_addr = self.get_fifo_rx_current_addr()
         self.set_fifo_addr_ptr(fifo_rx_current_addr)
-        payload = self.spi.xfer([REG.LORA.FIFO] + [0] * rx_nb_bytes)[1:]
+        payload = self._xfer([REG.LORA.FIFO] + [0] * rx_nb_bytes)[1:]
         return payload
 
+    def read_registers(self, register_address, count):
+        """ Burst read of contiguous registers in one SPI transfer, using the SX127x address auto-increment
+        :param register_address: First register address
+        :param count: Number of registers to read
+        :return: Register values
+        :rtype: list[int]
+        """
+        return self._xfer([register_address & 0x7F] + [0] * count)[1:]
+
+    def write_registers(self, register_address, values):
+        """ Burst write of contiguous registers in one SPI transfer, using the SX127x address auto-increment
+        :param register_address: First register address
+        :param values: Register values (list)
+        :return: Transferred bytes
+        """
+        return self._xfer([register_address | 0x80] + values)[1:]
+
+    def read_rx_packet(self):
+        """ Read the last received packet and its status with three SPI transfers, without leaving RX mode:
+            1. burst read of FIFO_RX_CURR_ADDR .. FEI_LSB (IRQ flags, RX_NB_BYTES, SNR, RSSI and FEI)
+            2. burst write of FIFO_ADDR_PTR .. IRQ_FLAGS (FIFO pointer to packet start and IRQ flags cleared)
+            3. FIFO read of the payload
+        :return: dict with payload (list[int]), irq_flags (dict), snr (dB), rssi (dBm) and fei (raw 20 bit)
+        :rtype: dict
+        """
+        base = REG.LORA.FIFO_RX_CURR_ADDR
+        regs = self.read_registers(base, REG.LORA.FEI_MSB + 3 - base)
+        fifo_rx_current_addr = regs[0]
+        irq_flags = regs[REG.LORA.IRQ_FLAGS - base]
+        rx_nb_bytes = regs[REG.LORA.RX_NB_BYTES - base]
+        snr = regs[REG.LORA.PKT_SNR_VALUE - base]
+        rssi = regs[REG.LORA.PKT_RSSI_VALUE - base]
+        msb, mid, lsb = regs[REG.LORA.FEI_MSB - base:REG.LORA.FEI_MSB - base + 3]
+        # FIFO_TX_BASE_ADDR, FIFO_RX_BASE_ADDR and IRQ_FLAGS_MASK are written back unchanged,
+        # FIFO_RX_CURR_ADDR is read-only and writing 1 to IRQ_FLAGS bits clears them
+        self.write_registers(REG.LORA.FIFO_ADDR_PTR, [fifo_rx_current_addr,
+                                                      self.get_fifo_tx_base_addr(),
+                                                      self.get_fifo_rx_base_addr(),
+                                                      0,
+                                                      regs[REG.LORA.IRQ_FLAGS_MASK - base],
+                                                      0xFF])
+        payload = self._xfer([REG.LORA.FIFO] + [0] * rx_nb_bytes)[1:]
+        return dict(
+                payload   = payload,
+                irq_flags = self._decode_irq_flags(irq_flags),
+                snr       = (float(snr-256) if snr > 127 else float(snr)) / 4.,
+                rssi      = rssi - (164 if BOARD.low_band else 157),     # See datasheet 5.5.5. p. 87
+                fei       = lsb + 256 * (mid + 256 * (msb & 0x0F))
+            )
+
     def get_freq(self):
         """ Get the frequency (MHz)
         :return:    Frequency in MHz
         :rtype:     float
         """
-        msb, mid, lsb = self.spi.xfer([REG.LORA.FR_MSB, 0, 0, 0])[1:]
+        msb, mid, lsb = self._xfer([REG.LORA.FR_MSB, 0, 0, 0])[1:]
         f = lsb + 256*(mid + 256*msb)
         return f / 16384.
 
@@ -287,10 +355,10 @@ class LoRa(object):
         mid = i // 256
         i -= mid * 256
         lsb = i
-        return self.spi.xfer([REG.LORA.FR_MSB | 0x80, msb, mid, lsb])
+        return self._xfer([REG.LORA.FR_MSB | 0x80, msb, mid, lsb])
 
     def get_pa_config(self, convert_dBm=False):
-        v = self.spi.xfer([REG.LORA.PA_CONFIG, 0])[1]
+        v = self._xfer([REG.LORA.PA_CONFIG, 0])[1]
         pa_select    = v >> 7
         max_power    = v >> 4 & 0b111
         output_power = v & 0b1111
@@ -318,7 +386,7 @@ class LoRa(object):
         current = self.get_pa_config()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['pa_select'] << 7) | (loc['max_power'] << 4) | (loc['output_power'])
-        return self.spi.xfer([REG.LORA.PA_CONFIG | 0x80, val])[1]
+        return self._xfer([REG.LORA.PA_CONFIG | 0x80, val])[1]
 
     @getter(REG.LORA.PA_RAMP)
     def get_pa_ramp(self, val):
@@ -329,7 +397,7 @@ class LoRa(object):
         return val & 0b1111
 
     def get_ocp(self, convert_mA=False):
-        v = self.spi.xfer([REG.LORA.OCP, 0])[1]
+        v = self._xfer([REG.LORA.OCP, 0])[1]
         ocp_on = v >> 5 & 0x01
         ocp_trim = v & 0b11111
         if convert_mA:
@@ -346,16 +414,16 @@ class LoRa(object):
 
     def set_ocp_trim(self, I_mA):
         assert(I_mA >= 45 and I_mA <= 240)
-        ocp_on = self.spi.xfer([REG.LORA.OCP, 0])[1] >> 5 & 0x01
+        ocp_on = self._xfer([REG.LORA.OCP, 0])[1] >> 5 & 0x01
         if I_mA <= 120:
             v = int(round((I_mA-45.)/5.))
         else:
             v = int(round((I_mA+30.)/10.))
         v = set_bit(v, 5, ocp_on)
-        return self.spi.xfer([REG.LORA.OCP | 0x80, v])[1]
+        return self._xfer([REG.LORA.OCP | 0x80, v])[1]
 
     def get_lna(self):
-        v = self.spi.xfer([REG.LORA.LNA, 0])[1]
+        v = self._xfer([REG.LORA.LNA, 0])[1]
         return dict(
                 lna_gain     = v >> 5,
                 lna_boost_lf = v >> 3 & 0b11,
@@ -372,7 +440,7 @@ class LoRa(object):
         current = self.get_lna()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['lna_gain'] << 5) | (loc['lna_boost_lf'] << 3) | (loc['lna_boost_hf'])
-        retval = self.spi.xfer([REG.LORA.LNA | 0x80, val])[1]
+        retval = self._xfer([REG.LORA.LNA | 0x80, val])[1]
         if lna_gain is not None:
             # agc_auto_on must track lna_gain: GAIN=NOT_USED -> agc_auto=ON, otherwise =OFF
             self.set_agc_auto_on(lna_gain == GAIN.NOT_USED)
@@ -382,31 +450,31 @@ class LoRa(object):
         self.set_lna(lna_gain=lna_gain)
 
     def get_fifo_addr_ptr(self):
-        return self.spi.xfer([REG.LORA.FIFO_ADDR_PTR, 0])[1]
+        return self._xfer([REG.LORA.FIFO_ADDR_PTR, 0])[1]
 
     def set_fifo_addr_ptr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_ADDR_PTR | 0x80, ptr])[1]
+        return self._xfer([REG.LORA.FIFO_ADDR_PTR | 0x80, ptr])[1]
 
     def get_fifo_tx_base_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_TX_BASE_ADDR, 0])[1]
+        return self._xfer([REG.LORA.FIFO_TX_BASE_ADDR, 0])[1]
 
     def set_fifo_tx_base_addr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_TX_BASE_ADDR | 0x80, ptr])[1]
+        return self._xfer([REG.LORA.FIFO_TX_BASE_ADDR | 0x80, ptr])[1]
 
     def get_fifo_rx_base_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BASE_ADDR, 0])[1]
+        return self._xfer([REG.LORA.FIFO_RX_BASE_ADDR, 0])[1]
 
     def set_fifo_rx_base_addr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BASE_ADDR | 0x80, ptr])[1]
+        return self._xfer([REG.LORA.FIFO_RX_BASE_ADDR | 0x80, ptr])[1]
 
     def get_fifo_rx_current_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_CURR_ADDR, 0])[1]
+        return self._xfer([REG.LORA.FIFO_RX_CURR_ADDR, 0])[1]
 
     def get_fifo_rx_byte_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BYTE_ADDR, 0])[1]
+        return self._xfer([REG.LORA.FIFO_RX_BYTE_ADDR, 0])[1]
 
     def get_irq_flags_mask(self):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
+        v = self._xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
         return dict(
                 rx_timeout     = v >> 7 & 0x01,
                 rx_done        = v >> 6 & 0x01,
@@ -422,16 +490,20 @@ class LoRa(object):
                            rx_timeout=None, rx_done=None, crc_error=None, valid_header=None, tx_done=None,
                            cad_done=None, fhss_change_ch=None, cad_detected=None):
         loc = locals()
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
+        v = self._xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
         for i, s in enumerate(['cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done', 'valid_header',
                                'crc_error', 'rx_done', 'rx_timeout']):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, i, this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK | 0x80, v])[1]
+        return self._xfer([REG.LORA.IRQ_FLAGS_MASK | 0x80, v])[1]
 
     def get_irq_flags(self):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS, 0])[1]
+        v = self._xfer([REG.LORA.IRQ_FLAGS, 0])[1]
+        return self._decode_irq_flags(v)
+
+    @staticmethod
+    def _decode_irq_flags(v):
         return dict(
                 rx_timeout     = v >> 7 & 0x01,
                 rx_done        = v >> 6 & 0x01,
@@ -446,13 +518,13 @@ class LoRa(object):
     def set_irq_flags(self,
                       rx_timeout=None, rx_done=None, crc_error=None, valid_header=None, tx_done=None,
                       cad_done=None, fhss_change_ch=None, cad_detected=None):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS, 0])[1]
+        v = self._xfer([REG.LORA.IRQ_FLAGS, 0])[1]
         for i, s in enumerate(['cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done', 'valid_header',
                                'crc_error', 'rx_done', 'rx_timeout']):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, i, this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
+        return self._xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
 
     def clear_irq_flags(self,
                         RxTimeout=None, RxDone=None, PayloadCrcError=None, 
@@ -465,22 +537,22 @@ class LoRa(object):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, eval('MASK.IRQ_FLAGS.' + s), this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
+        return self._xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
 
 
     def get_rx_nb_bytes(self):
-        return self.spi.xfer([REG.LORA.RX_NB_BYTES, 0])[1]
+        return self._xfer([REG.LORA.RX_NB_BYTES, 0])[1]
 
     def get_rx_header_cnt(self):
-        msb, lsb = self.spi.xfer([REG.LORA.RX_HEADER_CNT_MSB, 0, 0])[1:]
+        msb, lsb = self._xfer([REG.LORA.RX_HEADER_CNT_MSB, 0, 0])[1:]
         return lsb + 256 * msb
 
     def get_rx_packet_cnt(self):
-        msb, lsb = self.spi.xfer([REG.LORA.RX_PACKET_CNT_MSB, 0, 0])[1:]
+        msb, lsb = self._xfer([REG.LORA.RX_PACKET_CNT_MSB, 0, 0])[1:]
         return lsb + 256 * msb
 
     def get_modem_status(self):
-        status = self.spi.xfer([REG.LORA.MODEM_STAT, 0])[1]
+        status = self._xfer([REG.LORA.MODEM_STAT, 0])[1]
         return dict(
                 rx_coding_rate    = status >> 5 & 0x03,
                 modem_clear       = status >> 4 & 0x01,
@@ -491,19 +563,19 @@ class LoRa(object):
             )
 
     def get_pkt_snr_value(self):
-        v = self.spi.xfer([REG.LORA.PKT_SNR_VALUE, 0])[1]
+        v = self._xfer([REG.LORA.PKT_SNR_VALUE, 0])[1]
         return (float(v-256) if v > 127 else float(v)) / 4.
 
     def get_pkt_rssi_value(self):
-        v = self.spi.xfer([REG.LORA.PKT_RSSI_VALUE, 0])[1]
+        v = self._xfer([REG.LORA.PKT_RSSI_VALUE, 0])[1]
         return v - (164 if BOARD.low_band else 157)     # See datasheet 5.5.5. p. 87
 
     def get_rssi_value(self):
-        v = self.spi.xfer([REG.LORA.RSSI_VALUE, 0])[1]
+        v = self._xfer([REG.LORA.RSSI_VALUE, 0])[1]
         return v - (164 if BOARD.low_band else 157)     # See datasheet 5.5.5. p. 87
 
     def get_hop_channel(self):
-        v = self.spi.xfer([REG.LORA.HOP_CHANNEL, 0])[1]
+        v = self._xfer([REG.LORA.HOP_CHANNEL, 0])[1]
         return dict(
                 pll_timeout          = v >> 7,
                 crc_on_payload       = v >> 6 & 0x01,
@@ -511,7 +583,7 @@ class LoRa(object):
             )
 
     def get_modem_config_1(self):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_1, 0])[1]
+        val = self._xfer([REG.LORA.MODEM_CONFIG_1, 0])[1]
         return dict(
                 bw = val >> 4 & 0x0F,
                 coding_rate = val >> 1 & 0x07,
@@ -523,7 +595,7 @@ class LoRa(object):
         current = self.get_modem_config_1()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = loc['implicit_header_mode'] | (loc['coding_rate'] << 1) | (loc['bw'] << 4)
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_1 | 0x80, val])[1]
+        return self._xfer([REG.LORA.MODEM_CONFIG_1 | 0x80, val])[1]
 
     def set_bw(self, bw):
         """ Set the bandwidth 0=7.8kHz ... 9=500kHz
@@ -543,7 +615,7 @@ class LoRa(object):
         self.set_modem_config_1(implicit_header_mode=implicit_header_mode)
         
     def get_modem_config_2(self, include_symb_timout_lsb=False):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
+        val = self._xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
         d = dict(
                 spreading_factor = val >> 4 & 0x0F,
                 tx_cont_mode = val >> 3 & 0x01,
@@ -559,7 +631,7 @@ class LoRa(object):
         current = self.get_modem_config_2(include_symb_timout_lsb=True)
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['spreading_factor'] << 4) | (loc['tx_cont_mode'] << 3) | (loc['rx_crc'] << 2) | current['symb_timout_lsb']
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_2 | 0x80, val])[1]
+        return self._xfer([REG.LORA.MODEM_CONFIG_2 | 0x80, val])[1]
 
     def set_spreading_factor(self, spreading_factor):
         self.set_modem_config_2(spreading_factor=spreading_factor)
@@ -568,7 +640,7 @@ class LoRa(object):
         self.set_modem_config_2(rx_crc=rx_crc)
 
     def get_modem_config_3(self):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_3, 0])[1]
+        val = self._xfer([REG.LORA.MODEM_CONFIG_3, 0])[1]
         return dict(
                 low_data_rate_optim = val >> 3 & 0x01,
                 agc_auto_on = val >> 2 & 0x01
@@ -579,7 +651,7 @@ class LoRa(object):
         current = self.get_modem_config_3()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['low_data_rate_optim'] << 3) | (loc['agc_auto_on'] << 2)
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_3 | 0x80, val])[1]
+        return self._xfer([REG.LORA.MODEM_CONFIG_3 | 0x80, val])[1]
 
     @setter(REG.LORA.INVERT_IQ)
     def set_invert_iq(self, invert):
@@ -610,27 +682,27 @@ class LoRa(object):
 
     def get_symb_timeout(self):
         SYMB_TIMEOUT_MSB = REG.LORA.MODEM_CONFIG_2
-        msb, lsb = self.spi.xfer([SYMB_TIMEOUT_MSB, 0, 0])[1:]    # the MSB bits are stored in REG.LORA.MODEM_CONFIG_2
+        msb, lsb = self._xfer([SYMB_TIMEOUT_MSB, 0, 0])[1:]    # the MSB bits are stored in REG.LORA.MODEM_CONFIG_2
         msb = msb & 0b11
         return lsb + 256 * msb
 
     def set_symb_timeout(self, timeout):
-        bkup_reg_modem_config_2 = self.spi.xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
+        bkup_reg_modem_config_2 = self._xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
         msb = timeout >> 8 & 0b11    # bits 8-9
         lsb = timeout - 256 * msb    # bits 0-7
         reg_modem_config_2 = bkup_reg_modem_config_2 & 0xFC | msb    # bits 2-7 of bkup_reg_modem_config_2 ORed with the two msb bits
-        old_msb = self.spi.xfer([REG.LORA.MODEM_CONFIG_2  | 0x80, reg_modem_config_2])[1] & 0x03
-        old_lsb = self.spi.xfer([REG.LORA.SYMB_TIMEOUT_LSB | 0x80, lsb])[1]
+        old_msb = self._xfer([REG.LORA.MODEM_CONFIG_2  | 0x80, reg_modem_config_2])[1] & 0x03
+        old_lsb = self._xfer([REG.LORA.SYMB_TIMEOUT_LSB | 0x80, lsb])[1]
         return old_lsb + 256 * old_msb
 
     def get_preamble(self):
-        msb, lsb = self.spi.xfer([REG.LORA.PREAMBLE_MSB, 0, 0])[1:]
+        msb, lsb = self._xfer([REG.LORA.PREAMBLE_MSB, 0, 0])[1:]
         return lsb + 256 * msb
 
     def set_preamble(self, preamble):
         msb = preamble >> 8
         lsb = preamble - msb * 256
-        old_msb, old_lsb = self.spi.xfer([REG.LORA.PREAMBLE_MSB | 0x80, msb, lsb])[1:]
+        old_msb, old_lsb = self._xfer([REG.LORA.PREAMBLE_MSB | 0x80, msb, lsb])[1:]
         return old_lsb + 256 * old_msb
         
     @getter(REG.LORA.PAYLOAD_LENGTH)
@@ -658,7 +730,7 @@ class LoRa(object):
         return hop_period
 
     def get_fei(self):
-        msb, mid, lsb = self.spi.xfer([REG.LORA.FEI_MSB, 0, 0, 0])[1:]
+        msb, mid, lsb = self._xfer([REG.LORA.FEI_MSB, 0, 0, 0])[1:]
         msb &= 0x0F
         freq_error = lsb + 256 * (mid + 256 * msb)
         return freq_error
@@ -876,17 +948,52 @@ class LoRa(object):
         return result_list
 
     def get_register(self, register_address):
-        return self.spi.xfer([register_address & 0x7F, 0])[1]
+        return self._xfer([register_address & 0x7F, 0])[1]
 
     def set_register(self, register_address, val):
-        return self.spi.xfer([register_address | 0x80, val])[1]
+        return self._xfer([register_address | 0x80, val])[1]
 
     def get_all_registers(self):
         # read all registers
         reg = [0] + self.spi.xfer([1]+[0]*0x3E)[1:]
         self.mode = reg[1]
+        # (re)fill the shadow of the configuration registers
+        self.shadow = {}
+        if self.mode & 0x80:
+            for register_address in range(1, len(reg)):
+                if register_address not in self.volatile_registers:
+                    self.shadow[register_address] = reg[register_address]
         return reg
 
+    def _xfer(self, buf):
+        """ SPI transfer through the write-through shadow of the configuration registers.
+            Reads of shadowed registers are answered without SPI traffic. Volatile registers are always
+            transferred. The shadow is used in LoRa mode only, since FSK mode maps other registers on the same addresses.
+        :param buf: Register address (bit 7 set for write) followed by the data bytes (auto-incremented addresses)
+        :return: Transferred bytes, first byte is not meaningful
+        :rtype: list[int]
+        """
+        if self.shadow is None or self.mode is None or not self.mode & 0x80:
+            return self.spi.xfer(buf)
+        address = buf[0] & 0x7F
+        if address == REG.LORA.FIFO:
+            # FIFO bursts don't auto-increment the address
+            return self.spi.xfer(buf)
+        addresses = range(address, address + len(buf) - 1)
+        if buf[0] & 0x80:
+            for i, register_address in enumerate(addresses):
+                if register_address not in self.volatile_registers:
+                    self.shadow[register_address] = buf[i + 1]
+            return self.spi.xfer(buf)
+        shadow = self.shadow
+        if all(register_address in shadow for register_address in addresses):
+            return [0] + [shadow[register_address] for register_address in addresses]
+        result = self.spi.xfer(buf)
+        for i, register_address in enumerate(addresses):
+            if register_address not in self.volatile_registers:
+                shadow[register_address] = result[i + 1]
+        return result
+
     def __del__(self):
         self.set_mode(MODE.SLEEP)
         if self.verbose:
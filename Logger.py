@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Shared logging for the TNC modules.
+# logf() only filters on level and puts the message in a queue, so it can be
+# called from the radio interrupt callbacks. A background thread formats the
+# timestamps, prints the lines and writes them to config.logpath in batches,
+# flushing when config.log_flush_lines lines are pending or after
+# config.log_flush_interval seconds. The log file is rotated when it grows
+# over config.log_max_size bytes. When the log file can't be written the error
+# is reported once and opening it is retried every FILE_RETRY_INTERVAL seconds,
+# the lines of the meantime are only printed.
+
+import os
+import sys
+import time
+import atexit
+import threading
+from queue import SimpleQueue, Empty
+import config
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+FILE_RETRY_INTERVAL = 60.0  # seconds between attempts to open the log file after an error
+
+LEVELS = {
+    "DEBUG"   : DEBUG,
+    "INFO"    : INFO,
+    "WARNING" : WARNING,
+    "ERROR"   : ERROR
+}
+
+level = LEVELS.get(str(config.log_level).upper(), INFO)
+
+_queue = SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def log_enabled(lvl):
+    '''True if messages of level lvl are logged. Use it to skip building expensive messages'''
+    return lvl >= level
+
+def set_level(lvl):
+    global level
+    level = lvl
+
+def logf(message, lvl=INFO):
+    if lvl < level:
+        return
+    _queue.put((time.time(), message))
+    if _writer is None:
+        _start_writer()
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            writer = LogWriter(_queue)
+            writer.start()
+            atexit.register(writer.stop)
+            _writer = writer
+
+
+class LogWriter(threading.Thread):
+    '''Background thread writing queued log lines to console and log file'''
+
+    def __init__(self, queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.running = True
+        self.flush_lines = config.log_flush_lines
+        self.flush_interval = config.log_flush_interval
+        self.max_size = config.log_max_size
+        self.backup_count = config.log_backup_count
+        self.file = None
+        self.file_error = False  # an error was reported and the log file isn't writable yet
+        self.retry_time = 0.0
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.written = 0
+        # timestamp string is computed once per second
+        self.ts_second = None
+        self.ts_string = ""
+
+    def timestamp(self, t):
+        second = int(t)
+        if second != self.ts_second:
+            self.ts_second = second
+            self.ts_string = time.strftime('%Y/%m/%d %H:%M:%S - ', time.localtime(second))
+        return self.ts_string
+
+    def run(self):
+        while self.running:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                item = None
+            self.drain(item)
+            if self.written >= self.flush_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.write_file()
+        self.drain(None)
+        self.write_file()
+
+    def drain(self, item):
+        # format and print the given item and all the items already queued
+        lines = []
+        while True:
+            if item is not None:
+                lines.append(self.timestamp(item[0]) + item[1] + "\n")
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+        if lines:
+            text = "".join(lines)
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            self.pending.append(text)
+            self.written += len(lines)
+
+    def write_file(self):
+        self.last_flush = time.monotonic()
+        self.written = 0
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        if not config.log_enable:
+            return
+        if self.file is None and self.last_flush < self.retry_time:
+            return
+        try:
+            if self.file is None:
+                self.file = open(config.logpath, "a")
+            self.file.write("".join(pending))
+            self.file.flush()
+            if self.max_size > 0 and self.file.tell() >= self.max_size:
+                self.rotate()
+            if self.file_error:
+                self.file_error = False
+                sys.stderr.write("Log file writable again: %s\n" % config.logpath)
+        except OSError as e:
+            # reported once, not on every flush while the path is missing or unwritable
+            if not self.file_error:
+                self.file_error = True
+                sys.stderr.write("Log file error: %s\n" % e)
+            self.file = None
+            self.retry_time = self.last_flush + FILE_RETRY_INTERVAL
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            src = "%s.%d" % (config.logpath, i)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (config.logpath, i + 1))
+        if self.backup_count > 0:
+            os.replace(config.logpath, config.logpath + ".1")
+        else:
+            os.remove(config.logpath)
+
+    def stop(self):
+        self.running = False
+        self.join(self.flush_interval + 1)
@@ -17,29 +17,24 @@
 import datetime
 import time
 import config
+from Logger import logf, DEBUG, WARNING, ERROR
 import os
 import sys
-from asyncio import QueueEmpty
 import traceback
 currentdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.dirname(os.path.dirname(currentdir)))
 from SX126x import SX126x
+from TxScheduler import TxScheduler
+from Frame import Frame
+from Airtime import Airtime, ldro_resolve
 if config.disp_en:
    from display import display
-from PIL import Image
+   from PIL import Image
 from pathlib import Path
 
 if config.disp_en:
    display = display()
 
-def logf(message):
-    timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
-    if config.log_enable:
-       fileLog = open(config.logpath,"a")
-       fileLog.write(timestamp + message+"\n")
-       fileLog.close()
-    print(timestamp + message)
-
 def lcd(message):
        timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
        display.showtext(timestamp + message)
@@ -52,8 +47,12 @@ class LoraAprsKissTnc(SX126x): #Inheritance of SX126x class
     DATA_TYPE_MESSAGE = b":"
     DATA_TYPE_THIRD_PARTY = b"}"
 
+    CAD_SYMBOLS = {1: SX126x.CAD_ON_1_SYMB, 2: SX126x.CAD_ON_2_SYMB, 4: SX126x.CAD_ON_4_SYMB, 8: SX126x.CAD_ON_8_SYMB, 16: SX126x.CAD_ON_16_SYMB}
+
     queue = None
     server = None
+    scheduler = None
+    airtime = None
 
     # init has LoRa APRS default config settings - might be initialized different when creating object with parameters
     def __init__(self, queue, server, busId=0, csId=0, resetPin=22, busyPin=23, irqPin=26, txenPin=-1, rxenPin=-1,
@@ -69,6 +68,13 @@ class LoraAprsKissTnc(SX126x): #Inheritance of SX126x class
         self.queue = queue
         self.server = server
         self.appendSignalReport = appendSignalReport
+        # RX callback time of delivered frames, in seconds, reported by callbackStats()
+        self.rxFrames = 0
+        self.rxReadTime = 0.0
+        self.rxCallbackTime = 0.0
+        if config.CAD_SYMBOLS not in self.CAD_SYMBOLS:
+            raise ValueError("Invalid CAD_SYMBOLS in config.py: " + repr(config.CAD_SYMBOLS))
+        self.cadSymbols = self.CAD_SYMBOLS[config.CAD_SYMBOLS]
 
         if not self.begin(busId, csId, resetPin, busyPin, irqPin, txenPin, rxenPin) :
             raise Exception("Something wrong, can't begin LoRa radio")
@@ -98,61 +104,47 @@ class LoraAprsKissTnc(SX126x): #Inheritance of SX126x class
         # Datasheet requires that it must be used when the symbol duration exceeds 16ms. This is the case below:
         # - SF=12 and 11 in 125 kHz.
         # - SF=12 in 250 kHz.
-        if config.ldro=="": #ldro auto
-            if (sf==12 and (bw==125000 or bw==250000))or(sf==11 and bw==125000): #symbol duration >16ms
-                ldro=True
-            else:
-                ldro=False
-        elif config.ldro != False or config.ldro != True: # if wrong values
-            ldro = True #assign default value
-        else:
-            ldro = config.ldro #manual assignment from config.py                                                                            
-        # Configure modulation parameter including spreading factor (SF), bandwidth (BW), and coding rate (CR)
-        # Receiver must have same SF and BW setting with transmitter to be able to receive LoRa packet
-        self.setLoRaModulation(sf, bw, cr, ldro)
+        # ldro is "" for auto, otherwise True or False from config.py. Wrong values are set to True
+        ldro = ldro_resolve(ldro, sf, bw)
+        # time on air of this modulation, for TX timeout and by the TX scheduler
+        self.airtime = Airtime(sf, bw, cr, preamble, crcType, ldro)
+        with self.transaction(): # configuration commands are sent without interleaving with interrupt handlers
+            # Configure modulation parameter including spreading factor (SF), bandwidth (BW), and coding rate (CR)
+            # Receiver must have same SF and BW setting with transmitter to be able to receive LoRa packet
+            self.setLoRaModulation(sf, bw, cr, ldro)
 
-        # Configure packet parameter including header type, preamble length, payload length, and CRC type
-        # The explicit packet includes header contain CR, number of byte, and CRC type
-        # Receiver can receive packet with different CR and packet parameters in explicit header mode
-        self.setLoRaPacket(self.HEADER_EXPLICIT, preamble, payloadLength, crcType)
+            # Configure packet parameter including header type, preamble length, payload length, and CRC type
+            # The explicit packet includes header contain CR, number of byte, and CRC type
+            # Receiver can receive packet with different CR and packet parameters in explicit header mode
+            self.setLoRaPacket(self.HEADER_EXPLICIT, preamble, payloadLength, crcType)
 
-        self.setSyncWord(sync_word)
+            self.setSyncWord(sync_word)
 
-        #Set OCP to 140mA
-        self.setCurrentProtection(0x38)
+            #Set OCP to 140mA
+            self.setCurrentProtection(0x38)
 
-        # Set TX power, default power for SX1262 and SX1268 are +22 dBm and for SX1261 is +14 dBm
-        # This function will set PA config with optimal setting for requested TX power
-        self.setTxPower(outputPower, self.TX_POWER_SX1268)
+            # Set TX power, default power for SX1262 and SX1268 are +22 dBm and for SX1261 is +14 dBm
+            # This function will set PA config with optimal setting for requested TX power
+            self.setTxPower(outputPower, self.TX_POWER_SX1268)
 
         self.onReceive(self.callback) #callback function called after rx interrupt activation
+        self.onTransmit(self.txCallback) #callback function called after tx interrupt activation
         self.request(self.RX_CONTINUOUS) #Set receiver in continuous rx mode
      
-    #Frequency offset register is not documented on Semtech datasheets.
-    #This function is inspred from Radiolib (https://github.com/jgromes/RadioLib/blob/master/src/modules/SX126x.cpp)
-    def getFreqError(self)  :
-        state = self.readRegister(0x076B, 3)
-        efe = (state[0]<<16 | state[1]<<8 | state[2]) & 0x0FFFFF
-        #check the first bit
-        if (efe & 0x80000) :
-           efe = efe - (1<<20) #compute negative value
-        error = 1.55 * efe / (1600 / (config.bandwidth/1000))
-        return error
-
     def callback(self) :
 
-      payload = [] #put received data into list of integers
-      while self.available() >= 1 :
-          payload.append(self.read())
-
-      payload=bytes(payload) #int-->bytes
+      t = time.perf_counter()
+      payload = self.readPayload() #whole payload in one SPI transaction
+      readTime = time.perf_counter() - t
       if not payload:
-            logf("No Payload!")
+            logf("No Payload!", WARNING)
             return
-      rssi = self.packetRssi()
-      snr = self.snr()
-      freq_err=self.getFreqError()
-      signalreport = "Level:"+str(rssi)+" dBm, SNR:"+str(snr)+"dB"
+      if self.scheduler:
+            self.scheduler.received(len(payload)) # channel utilisation, frames with errors included
+      pkt = self.packetStatus()
+      rssi = pkt.rssi
+      snr = pkt.snr
+      freq_err = pkt.freqError
       logf("LoRa RX[RSSI=%idBm, SNR=%.2fdB, %iBytes, Freq.Offset: %iHz]: %s" %(rssi, snr, len(payload), freq_err, repr(payload)))
       if config.disp_en:
          lcd("LoRa RX[RSSI=%idBm, SNR=%.2fdB, %iBytes, Freq.Offset: %iHz]: %s" %(rssi, snr, len(payload), freq_err, repr(payload)))
@@ -160,52 +152,84 @@ class LoraAprsKissTnc(SX126x): #Inheritance of SX126x class
       # Show received status in case CRC or header error occur
       status = self.status()
       if status == self.STATUS_CRC_ERR :
-         logf("CRC error, discarding frame...")
+         logf("CRC error, discarding frame...", WARNING)
          return
       elif status == self.STATUS_HEADER_ERR :
-         logf("Packet header error, discarding frame...")
+         logf("Packet header error, discarding frame...", WARNING)
          return
       if self.server:
-            self.server.send(payload,signalreport)
+            self.server.send(Frame.fromRadio(payload, rssi, snr, freq_err))
+      callbackTime = time.perf_counter() - t
+      self.rxFrames += 1
+      self.rxReadTime += readTime
+      self.rxCallbackTime += callbackTime
+      logf("RX callback: payload read %.2fms, total %.2fms" %(readTime * 1000, callbackTime * 1000), DEBUG)
+
+    def callbackStats(self):
+        # frames delivered by the RX callback and total time spent reading payload and in the whole callback, in seconds
+        return dict(frames=self.rxFrames, read_time=self.rxReadTime, callback_time=self.rxCallbackTime)
 
     def startListening(self):
+        # frames are sent by the scheduler thread as soon as they are queued and the channel is clear
+        self.scheduler = TxScheduler(self.queue, self.sendFrame, self.channelBusy, self.airtime)
+        if self.server:
+            self.server.scheduler = self.scheduler # channel access parameters are set by KISS commands
         try:
-            while True:
-                # only transmit if no signal is detected to avoid collisions
-                if not self.busyCheck(1):
-                    if not self.queue.empty():
-                        try:
-                            data = self.queue.get(block=False)
-                            if config.TX_OE_Style:
-                               if self.aprs_data_type(data) == self.DATA_TYPE_THIRD_PARTY:
-                                   # remove third party thing in case of OE_Style tx
-                                   data = data[data.find(self.DATA_TYPE_THIRD_PARTY) + 1:]
-                               data = self.LORA_APRS_HEADER + data
-                               logf("\033[94mLoRa TX OE Syle packet: \033[0m" + repr(data))
-                               if config.disp_en:
-                                  lcd("LoRa TX OE Syle packet: " + repr(data))
-                            else:
-                                logf("\033[95mLoRa TX Standard AX25 packet: \033[0m" + repr(data))
-                                if config.disp_en:
-                                  lcd("LoRa TX Standard AX25 packet: " + repr(data))
-                            self.transmit(data)
-                        except QueueEmpty:
-                            pass
-                time.sleep(0.50)
+            self.scheduler.start()
+            self.scheduler.join()
         except KeyboardInterrupt:
+            self.scheduler.stop()
             logf("Keyboard Interrupt received. Exiting...")
             if config.disp_en:
               lcd("Keyboard Interrupt received. Exiting...")
 
+    def channelBusy(self):
+        # a frame is being received or CAD detects LoRa activity. CAD leaves the radio in standby
+        with self.transaction(): # RX handler doesn't run between the receiving check, CAD and RX restart
+            if self.receiving():
+                return True
+            if not config.CAD:
+                return False
+            busy = self.cad(self.cadSymbols)
+            self.request(self.RX_CONTINUOUS)
+            return busy
+
+    def sendFrame(self, frame):
+        data = frame.data
+        if frame.oe:
+           if frame.dti == self.DATA_TYPE_THIRD_PARTY:
+               # remove third party thing in case of OE_Style tx
+               data = data[data.find(self.DATA_TYPE_THIRD_PARTY) + 1:]
+           data = self.LORA_APRS_HEADER + data
+           logf("\033[94mLoRa TX OE Syle packet: \033[0m" + repr(data))
+           if config.disp_en:
+              lcd("LoRa TX OE Syle packet: " + repr(data))
+        else:
+            logf("\033[95mLoRa TX Standard AX25 packet: \033[0m" + repr(data))
+            if config.disp_en:
+              lcd("LoRa TX Standard AX25 packet: " + repr(data))
+        logf("LoRa TX queue latency: %.0fms" %(frame.latency * 1000), DEBUG)
+        self.transmit(data)
+
+    def txCallback(self) :
+
+      if self.status() == self.STATUS_TX_TIMEOUT :
+         logf("LoRa TX timeout", WARNING)
+      else :
+         logf("LoRa TX done in %.0fms" %(self.transmitTime()))
+
     def transmit(self, data):
 
-        messageList = list(data)
-        for i in range(len(messageList)) : messageList[i] = int(messageList[i])
-        # write() method must be placed between beginPacket() and endPacket()
-        self.beginPacket()
-        self.write(messageList, len(messageList))
-        self.endPacket()
-        self.wait() # Wait until modulation process for transmitting packet finish
+        # TX timeout is time on air plus margin. It's used both by the chip and for waiting TX interrupt
+        timeout = self.airtime.tx_timeout(len(data))
+        # put() method must be placed between beginPacket() and endPacket()
+        with self.transaction(): # commands from buffer setup to TX start are sent without interleaving with the RX handler
+            self.beginPacket()
+            self.put(data)
+            self.endPacket(int(timeout * 1000))
+        # Sleep until TX interrupt reports end of transmission, the radio is not polled while on air
+        if not self.waitTx(timeout + 0.5):
+            logf("LoRa TX interrupt not received, TX done assumed after %.0fms" %(self.transmitTime()), WARNING)
         self.request(self.RX_CONTINUOUS) #Request for receiving new LoRa packet in RX continuous mode
 
     def aprs_data_type(self, lora_aprs_frame):
@@ -16,16 +16,26 @@
 import datetime
 import time
 import config
+from Logger import logf, DEBUG, WARNING, ERROR
 import sys
-from asyncio import QueueEmpty
+import threading
 import traceback
-sys.path.insert(0, './pySX127x/')
-from pySX127x.SX127x.LoRa import LoRa
-from pySX127x.SX127x.constants import *
-from pySX127x.SX127x.board_config import BOARD
+if config.hardware == "sim":
+    # simulated radio: SX127x driver files of this repository, the pySX127x checkout isn't needed
+    from LoRa import LoRa
+    from constants import *
+    from board_config import BOARD
+else:
+    sys.path.insert(0, './pySX127x/')
+    from pySX127x.SX127x.LoRa import LoRa
+    from pySX127x.SX127x.constants import *
+    from pySX127x.SX127x.board_config import BOARD
+from TxScheduler import TxScheduler
+from Frame import Frame
+from Airtime import Airtime, ldro_resolve
 if config.disp_en:
    from display import display
-from PIL import Image
+   from PIL import Image
 from pathlib import Path
 
 #import RPi.GPIO as GPIO
@@ -34,14 +44,6 @@ from pathlib import Path
 if config.disp_en:
    display = display()
 
-def logf(message):
-    timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
-    if config.log_enable:
-       fileLog = open(config.logpath,"a")
-       fileLog.write(timestamp + message+"\n")
-       fileLog.close()
-    print(timestamp + message+"\n")
-
 def lcd(message):
        timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
        display.showtext(timestamp + message)
@@ -56,6 +58,12 @@ class LoraAprsKissTnc(LoRa):
 
     queue = None
     server = None
+    scheduler = None
+    airtime = None
+    txDone = None
+    cadDone = None
+    lock = None
+    txPending = False
 
     # init has LoRa APRS default config settings - might be initialized different when creating object with parameters
     def __init__(self, queue, server, frequency=433775000, preamble=8, spreadingFactor=12, bandwidth=BW.BW125,
@@ -72,6 +80,8 @@ class LoraAprsKissTnc(LoRa):
         if config.disp_en:
            lcd("LoRa radio initialized. Waiting for LoRa Spots...")
 
+        # radio access of the scheduler thread (CAD, TX start) and of the DIO0 handlers (RX, TX done) is serialised
+        self.lock = threading.RLock()
         super(LoraAprsKissTnc, self).__init__(verbose)
         self.queue = queue
         self.appendSignalReport = appendSignalReport
@@ -96,18 +106,17 @@ class LoraAprsKissTnc(LoRa):
         }
 
         self.set_bw(bw[bandwidth])
+        # CAD lasts about two symbols, it's waited for twice that time
+        self.cadTimeout = 4 * (1 << spreadingFactor) / bandwidth + 0.01
 
 	# Set Low Data Rate Optimization starting from configured SF and BW.
         # Datasheet requires that it must be used when the symbol duration exceeds 16ms. This is the case below:
         # - SF=12 and 11 in 125 kHz.
         # - SF=12 in 250 kHz.
-        if config.ldro=="": #ldro auto
-            if (spreadingFactor==12 and (bandwidth==125000 or bandwidth==250000))or(spreadingFactor==11 and bandwidth==125000): #symbol duration >16ms
-                ldro=True
-            else:
-                ldro=False
-        else:
-            ldro = config.ldro #manual assignment from config.py
+        # ldro is "" for auto, otherwise True or False from config.py
+        ldro = ldro_resolve(ldro, spreadingFactor, bandwidth)
+        # time on air of this modulation, for TX timeout and by the TX scheduler
+        self.airtime = Airtime(spreadingFactor, bandwidth, codingrate, preamble, crc, ldro)
 
         self.set_low_data_rate_optim(ldro)
 
@@ -129,44 +138,75 @@ class LoraAprsKissTnc(LoRa):
         self.set_max_payload_length(255)
         self.set_dio_mapping([0] * 6)
         self.server = server
+        self.txDone = threading.Event()
+        self.cadDone = threading.Event()
 
         self.reset_ptr_rx()
         self.set_mode(MODE.RXCONT)
         #self.set_mode(MODE.SLEEP)
 
     def startListening(self):
+        # frames are sent by the scheduler thread as soon as they are queued and the channel is clear
+        self.scheduler = TxScheduler(self.queue, self.sendFrame, self.channelBusy, self.airtime)
+        if self.server:
+            self.server.scheduler = self.scheduler # channel access parameters are set by KISS commands
         try:
-            while True:
-                # only transmit if no signal is detected to avoid collisions
-                if not self.get_modem_status()["signal_detected"]:
-                    # print("RSSI: %idBm" % lora.get_rssi_value())
-                    # FIXME: Add noise floor measurement for telemetry
-                    if not self.queue.empty():
-                        try:
-                            data = self.queue.get(block=False)
-                            #if self.aprs_data_type(data) == self.DATA_TYPE_THIRD_PARTY:
-                                # remove third party thing
-                                #data = data[data.find(self.DATA_TYPE_THIRD_PARTY) + 1:]
-                            if config.TX_OE_Style:
-                                data = self.LORA_APRS_HEADER + data
-                                logf("LoRa TX OE Syle packet: " + repr(data))
-                                if config.disp_en:
-                                   lcd("LoRa TX OE Syle packet: " + repr(data))
-                            else:
-                                logf("LoRa TX Standard AX25 packet: " + repr(data))
-                                if config.disp_en:
-                                   lcd("LoRa TX Standard AX25 packet: " + repr(data))
-
-                            self.transmit(data)
-                        except QueueEmpty:
-                            pass
-
-                time.sleep(0.50)
+            self.scheduler.start()
+            self.scheduler.join()
         except KeyboardInterrupt:
+            self.scheduler.stop()
             logf("Keyboard Interrupt received. Exiting...")
             if config.disp_en:
                lcd("Keyboard Interrupt received. Exiting...")
             BOARD.teardown()
+
+    def channelBusy(self):
+        # FIXME: Add noise floor measurement for telemetry
+        # a frame is being received or CAD detects LoRa activity
+        with self.lock: # RX handler doesn't run between the signal check, CAD and RX restart
+            if self.get_modem_status()["signal_detected"]:
+                return True
+            if not config.CAD:
+                return False
+            self.set_mode(MODE.STDBY)
+            # a packet received before standby would be lost when DIO0 is mapped to CadDone, pass it to the RX handler
+            if self.get_irq_flags()["rx_done"]:
+                self.receive()
+            self.cadDone.clear()
+            self.clear_irq_flags(CadDone=1, CadDetected=1)
+            self.set_dio_mapping([2, 0, 0, 0, 0, 0])
+            self.set_mode(MODE.CAD)
+            # CadDone flag is checked too: an RX interrupt dispatched after the DIO0 mapping change calls on_cad_done()
+            deadline = time.monotonic() + self.cadTimeout
+            flags = self.get_irq_flags()
+            while not flags["cad_done"] and time.monotonic() < deadline:
+                self.cadDone.wait(max(deadline - time.monotonic(), 0))
+                self.cadDone.clear()
+                flags = self.get_irq_flags()
+            self.clear_irq_flags(CadDone=1, CadDetected=1)
+            self.set_dio_mapping([0] * 6)
+            self.set_mode(MODE.RXCONT)
+            return bool(flags["cad_detected"])
+
+    def on_cad_done(self):
+        self.cadDone.set()
+
+    def sendFrame(self, frame):
+        #if frame.dti == self.DATA_TYPE_THIRD_PARTY:
+            # remove third party thing
+            #data = data[data.find(self.DATA_TYPE_THIRD_PARTY) + 1:]
+        data = frame.onAir()
+        if frame.oe:
+            logf("LoRa TX OE Syle packet: " + repr(data))
+            if config.disp_en:
+               lcd("LoRa TX OE Syle packet: " + repr(data))
+        else:
+            logf("LoRa TX Standard AX25 packet: " + repr(data))
+            if config.disp_en:
+               lcd("LoRa TX Standard AX25 packet: " + repr(data))
+        logf("LoRa TX queue latency: %.0fms" %(frame.latency * 1000), DEBUG)
+        self.transmit(data)
+
     def twos_comp(self,val, bits):
         """compute the 2's complement of int value val"""
         if (val & (1 << (bits - 1))) != 0: # if sign bit is set
@@ -174,46 +214,72 @@ class LoraAprsKissTnc(LoRa):
         return val                         # else return positive value as is
 
     def on_rx_done(self):
-        payload = self.read_payload(nocheck=True)
+        with self.lock:
+            # nothing to read when the interrupt is handled after the modem left RX, e.g. for CAD or TX
+            if self.mode != MODE.RXCONT:
+                return
+            self.receive()
+
+    def receive(self):
+        # payload, IRQ flags and signal report are read with three SPI transfers, the modem stays in RX continuous mode
+        packet = self.read_rx_packet()
+        if not packet["irq_flags"]["rx_done"]:
+            return # packet already passed to the RX handler by channelBusy()
+        payload = packet["payload"]
         if not payload:
-            logf("No Payload!")
+            logf("No Payload!", WARNING)
             return
-        rssi = self.get_pkt_rssi_value()
-        snr = self.get_pkt_snr_value()
-        freq_err = self.twos_comp(self.get_fei(),20)*pow(2,24)/32e6*config.bandwidth/1000/500
-        signalreport = "Level:"+str(rssi)+" dBm, SNR:"+str(snr)+"dB"
+        rssi = packet["rssi"]
+        snr = packet["snr"]
+        freq_err = self.twos_comp(packet["fei"],20)*pow(2,24)/32e6*config.bandwidth/1000/500
         data = bytes(payload)
+        if self.scheduler:
+            self.scheduler.received(len(data)) # channel utilisation, frames with errors included
         logf("LoRa RX[%idBm/%.2fdB, %iHz ,%ibytes]: %s" %(rssi, snr, freq_err, len(data), repr(data)))
         if config.disp_en:
            lcd("LoRa RX[%idBm/%.2fdB, %iHz ,%ibytes]: %s" %(rssi, snr, freq_err, len(data), repr(data)))
 
-        flags = self.get_irq_flags()
-        if any([flags[s] for s in ['crc_error', 'rx_timeout']]):
-            logf("Receive Error, discarding frame.")
-            # print(self.get_irq_flags())
-            self.clear_irq_flags(RxDone=1, PayloadCrcError=1, RxTimeout=1)  # clear rxdone IRQ flag
-            self.reset_ptr_rx()
-            self.set_mode(MODE.RXCONT)
+        flags = packet["irq_flags"]
+        if flags['crc_error'] or flags['rx_timeout']:
+            logf("Receive Error, discarding frame.", WARNING)
             return
 
         if self.server:
-            self.server.send(data, signalreport)
-        self.clear_irq_flags(RxDone=1)  # clear rxdone IRQ flag
-        self.reset_ptr_rx()
-        self.set_mode(MODE.RXCONT)
+            self.server.send(Frame.fromRadio(data, rssi, snr, freq_err))
 
     # self.set_mode(MODE.CAD)
 
     def on_tx_done(self):
-        logf("TX DONE")
+        with self.lock:
+            # a late interrupt after the TX timeout, or an RX interrupt dispatched while on air, does nothing
+            if not self.txPending or not self.get_irq_flags()["tx_done"]:
+                return
+            logf("TX DONE")
+            self.end_tx()
+
+    def end_tx(self):
+        # back to RX continuous after TX done or TX timeout, called with the lock held
+        self.txPending = False
         self.clear_irq_flags(TxDone=1)  # clear txdone IRQ flag
         self.set_dio_mapping([0] * 6)
         self.set_mode(MODE.RXCONT)
+        self.txDone.set()
 
     def transmit(self, data):
-        self.write_payload([c for c in data])
-        self.set_dio_mapping([1, 0, 0, 0, 0, 0])
-        self.set_mode(MODE.TX)
+        with self.lock:
+            self.txDone.clear()
+            self.write_payload(list(data))
+            # TxDone flag of a previous TX ended by timeout would keep DIO0 high, hiding the rising edge of this one
+            self.clear_irq_flags(TxDone=1)
+            self.set_dio_mapping([1, 0, 0, 0, 0, 0])
+            self.txPending = True
+            self.set_mode(MODE.TX)
+        # wait for TX done interrupt, the next frame can't be loaded in FIFO while on air
+        if not self.txDone.wait(self.airtime.tx_timeout(len(data))):
+            with self.lock:
+                if self.txPending:
+                    logf("TX DONE interrupt not received", WARNING)
+                    self.end_tx()
 
     def aprs_data_type(self, lora_aprs_frame):
         delimiter_position = lora_aprs_frame.find(b":")
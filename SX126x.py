@@ -1,12 +1,32 @@
-import spidev
-import RPi.GPIO
+from Hardware import gpio, SpiDev
 import time
+import math
+import threading
+import contextlib
 
-spi = spidev.SpiDev()
-gpio = RPi.GPIO
-gpio.setmode(RPi.GPIO.BCM)
+spi = SpiDev()
+gpio.setmode(gpio.BCM)
 gpio.setwarnings(False)
 
+class PacketStatus :
+
+    # snapshot of signal metrics of last incoming package, filled from one GetPacketStatus command and one frequency error register read
+    __slots__ = ('rssi', 'snr', 'signalRssi', 'freqError')
+
+    def __init__(self, rssiPkt: int, snrPkt: int, signalRssiPkt: int, freqErrorRaw: tuple, bw: int) :
+
+        self.rssi = rssiPkt / -2.0
+        if snrPkt > 127 : snrPkt = snrPkt - 256
+        self.snr = snrPkt / 4.0
+        self.signalRssi = signalRssiPkt / -2.0
+        # frequency error register is not documented on Semtech datasheets, conversion inspired from Radiolib
+        # (https://github.com/jgromes/RadioLib/blob/master/src/modules/SX126x.cpp)
+        efe = 0
+        if len(freqErrorRaw) == 3 :
+            efe = (freqErrorRaw[0] << 16 | freqErrorRaw[1] << 8 | freqErrorRaw[2]) & 0x0FFFFF
+            if efe & 0x80000 : efe = efe - (1 << 20)
+        self.freqError = 1.55 * efe / (1600 / (bw / 1000))
+
 class SX126x :
 
     # SX126X register map
@@ -80,6 +100,7 @@ class SX126x :
     IRQ_CAD_DETECTED                       = 0x0100      # channel activity detected
     IRQ_TIMEOUT                            = 0x0200      # Rx or Tx timeout
     IRQ_ALL                                = 0x03FF      # all interrupts
+    IRQ_RX_END                             = 0x0262      # RX done, header error, CRC error or timeout: end of a receive operation
     IRQ_NONE                               = 0x0000      # no interrupts
 
     # SetDio2AsRfSwitch
@@ -250,6 +271,17 @@ class SX126x :
     # Get fequency error
     FREQ_ERROR                             = 0x076B
 
+    # BUSY wait strategy
+    BUSY_WAIT_FAST                         = 0           # busy pin already low, single read
+    BUSY_WAIT_SPIN                         = 1           # short bounded spin on busy pin
+    BUSY_WAIT_EDGE                         = 2           # sleep on busy pin falling edge
+    BUSY_SPIN_TIME                         = 0.0002      # spin duration limit in second before falling back to edge wait
+    BUSY_EDGE_SLICE                        = 0.01        # edge wait slice in second, busy pin level is checked again after each slice
+    BUSY_LONG_OPCODES                      = (0x82, 0x83, 0x84, 0x89, 0x97, 0x98, 0xC5)  # setRx, setTx, setSleep, calibrate, setDio3AsTcxoCtrl, calibrateImage, setCad
+
+    # Configuration commands skipped when parameters are the same of last sent
+    CACHED_OPCODES                         = (0x08, 0x86, 0x88, 0x8A, 0x8B, 0x8C, 0x8E, 0x8F, 0x93, 0x95, 0x96, 0x9D, 0xA0)
+
     # SPI and GPIO pin setting
     _bus = 0
     _cs = 0
@@ -260,6 +292,12 @@ class SX126x :
     _rxen = -1
     _wake = -1
     _busyTimeout = 5000
+    _busyLongOp = False
+    _busyWaits = None
+    _busyTime = None
+    _busyLow = None
+    _lock = None
+    _cmdCache = None
     _spiSpeed = 7800000
     _txState = gpio.LOW
     _rxState = gpio.LOW
@@ -283,6 +321,7 @@ class SX126x :
     _statusWait = STATUS_DEFAULT
     _statusIrq = STATUS_DEFAULT
     _transmitTime = 0.0
+    _txDone = None
 
     # callback functions
     _onTransmit = None
@@ -292,6 +331,14 @@ class SX126x :
 
     def begin(self, bus: int = _bus, cs: int = _cs, reset: int = _reset, busy: int = _busy, irq: int = _irq, txen: int = _txen, rxen: int = _rxen, wake: int = _wake) :
 
+        # TX done event set by TX interrupt handler
+        self._txDone = threading.Event()
+        # wait count and time spent for each busy wait mode
+        self._busyWaits = [0, 0, 0]
+        self._busyTime = [0.0, 0.0, 0.0]
+        # SPI access lock shared by caller threads and interrupt handlers, and last parameters sent for configuration commands
+        self._lock = threading.RLock()
+        self._cmdCache = {}
         # set spi and gpio pins
         self.setSpi(bus, cs)
         self.setPins(reset, busy, irq, txen, rxen, wake)
@@ -318,6 +365,8 @@ class SX126x :
         gpio.output(self._reset, gpio.LOW)
         time.sleep(0.001)
         gpio.output(self._reset, gpio.HIGH)
+        self._clearCmdCache()
+        self._busyLongOp = True
         return not self.busyCheck()
 
     def sleep(self, option = SLEEP_WARM_START) :
@@ -343,12 +392,67 @@ class SX126x :
 
     def busyCheck(self, timeout: int = _busyTimeout) :
 
-        # wait for busy pin to LOW or timeout reached
-        t = time.time()
-        while gpio.input(self._busy) == gpio.HIGH :
-            if (time.time() - t) > (timeout / 1000) : return True
+        # wait for busy pin to LOW or timeout reached, return True when timeout reached
+        t = time.perf_counter()
+        # fast path: busy pin is already low
+        if gpio.input(self._busy) == gpio.LOW :
+            self._busyLongOp = False
+            self._busyCount(self.BUSY_WAIT_FAST, t)
+            return False
+        deadline = t + timeout / 1000
+        # short bounded spin for quick commands, skipped after long operations like calibration or TX start
+        if not self._busyLongOp :
+            spinEnd = min(t + self.BUSY_SPIN_TIME, deadline)
+            while time.perf_counter() < spinEnd :
+                if gpio.input(self._busy) == gpio.LOW :
+                    self._busyCount(self.BUSY_WAIT_SPIN, t)
+                    return False
+        self._busyLongOp = False
+        # edge wait: sleep until busy pin falling edge sets the event. Event is cleared before the level check, so an edge can't be missed.
+        # GPIO callbacks run in one thread, when busyCheck() is called by the IRQ handler the event is not set and the level is checked after each slice
+        busyLow = self._busyLow
+        while True :
+            busyLow.clear()
+            if gpio.input(self._busy) == gpio.LOW : break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 :
+                self._busyCount(self.BUSY_WAIT_EDGE, t)
+                return True
+            busyLow.wait(min(remaining, self.BUSY_EDGE_SLICE))
+        self._busyCount(self.BUSY_WAIT_EDGE, t)
         return False
 
+    def _interruptBusy(self, channel) :
+
+        self._busyLow.set()
+
+    def _busyCount(self, mode: int, t: float) :
+
+        if self._busyWaits is None : return
+        self._busyWaits[mode] += 1
+        self._busyTime[mode] += time.perf_counter() - t
+
+    def busyStats(self) -> dict :
+
+        # get number of waits and time spent in second for each busy wait mode
+        return {
+            "fast": (self._busyWaits[self.BUSY_WAIT_FAST], self._busyTime[self.BUSY_WAIT_FAST]),
+            "spin": (self._busyWaits[self.BUSY_WAIT_SPIN], self._busyTime[self.BUSY_WAIT_SPIN]),
+            "edge": (self._busyWaits[self.BUSY_WAIT_EDGE], self._busyTime[self.BUSY_WAIT_EDGE])
+        }
+
+    @contextlib.contextmanager
+    def transaction(self) :
+
+        # commands sent inside the context by one thread are not interleaved with commands of other threads,
+        # e.g. RX interrupt handler. Commands are sent immediately, each one needs busy pin low before it
+        with self._lock :
+            yield self
+
+    def _clearCmdCache(self) :
+
+        if self._cmdCache is not None : self._cmdCache.clear()
+
     def setFallbackMode(self, fallbackMode) :
 
         self.setRxTxFallbackMode(fallbackMode)
@@ -382,6 +486,10 @@ class SX126x :
         gpio.setup(reset, gpio.OUT)
         gpio.setup(busy, gpio.IN)
         if irq != -1 : gpio.setup(irq, gpio.IN)
+        # busy pin falling edge is detected by the GPIO library for the whole session, busyCheck() waits on an event
+        self._busyLow = threading.Event()
+        gpio.remove_event_detect(busy)
+        gpio.add_event_detect(busy, gpio.FALLING, callback=self._interruptBusy)
         if txen != -1 : gpio.setup(txen, gpio.OUT)
         if rxen != -1 : gpio.setup(rxen, gpio.OUT)
 
@@ -654,26 +762,27 @@ class SX126x :
         # skip to enter TX mode when previous TX operation incomplete
         if self.getMode == self.STATUS_MODE_TX : return False
 
-        # clear previous interrupt and set TX done, and TX timeout as interrupt source
-        self._irqSetup(self.IRQ_TX_DONE | self.IRQ_TIMEOUT)
-        # set packet payload length
-        self.setPacketParamsLoRa(self._preambleLength, self._headerType, self._payloadTxRx, self._crcType, self._invertIq)
-
-        # set status to TX wait
-        self._statusWait = self.STATUS_TX_WAIT
-        self._statusIrq = 0x0000
         # calculate TX timeout config
         txTimeout = timeout << 6
         if txTimeout > 0x00FFFFFF : txTimeout = self.TX_SINGLE
 
-        # set device to transmit mode with configured timeout or single operation
-        self.setTx(txTimeout)
-        self._transmitTime = time.time()
-
-        # set operation status to wait and attach TX interrupt handler
-        if self._irq != -1 and intFlag :
-            gpio.remove_event_detect(self._irq)
-            gpio.add_event_detect(self._irq, gpio.RISING, callback=self._interruptTx, bouncetime=10)
+        # set status to TX wait
+        self._statusWait = self.STATUS_TX_WAIT
+        self._statusIrq = 0x0000
+        if self._txDone is not None : self._txDone.clear()
+
+        with self.transaction() :
+            # attach TX interrupt handler before TX start, it waits for the end of the transaction
+            if self._irq != -1 and intFlag :
+                gpio.remove_event_detect(self._irq)
+                gpio.add_event_detect(self._irq, gpio.RISING, callback=self._interruptTx, bouncetime=10)
+            # clear previous interrupt and set TX done, and TX timeout as interrupt source
+            self._irqSetup(self.IRQ_TX_DONE | self.IRQ_TIMEOUT)
+            # set packet payload length
+            self.setPacketParamsLoRa(self._preambleLength, self._headerType, self._payloadTxRx, self._crcType, self._invertIq)
+            # set device to transmit mode with configured timeout or single operation, TX time is measured from here
+            self.setTx(txTimeout)
+            self._transmitTime = time.time()
         return True
 
     def write(self, data, length: int = 0) :
@@ -710,9 +819,6 @@ class SX126x :
         # skip to enter RX mode when previous RX operation incomplete
         if self.getMode() == self.STATUS_MODE_RX : return False
 
-        # clear previous interrupt and set RX done, RX timeout, header error, and CRC error as interrupt source
-        self._irqSetup(self.IRQ_RX_DONE | self.IRQ_TIMEOUT | self.IRQ_HEADER_ERR | self.IRQ_CRC_ERR)
-
         # set status to RX wait or RX continuous wait
         self._statusWait = self.STATUS_RX_WAIT
         self._statusIrq = 0x0000
@@ -730,8 +836,13 @@ class SX126x :
             gpio.output(self._txen, gpio.LOW)
             gpio.output(self._rxen, gpio.HIGH)
 
-        # set device to receive mode with configured timeout, single, or continuous operation
-        self.setRx(rxTimeout)
+        with self.transaction() :
+            # clear previous interrupt and set RX done, RX timeout, header error, and CRC error as interrupt source
+            # valid header is only latched in IRQ status without interrupt, it's used by receiving()
+            irqMask = self.IRQ_RX_DONE | self.IRQ_TIMEOUT | self.IRQ_HEADER_ERR | self.IRQ_CRC_ERR
+            self._irqSetup(irqMask | self.IRQ_HEADER_VALID, irqMask)
+            # set device to receive mode with configured timeout, single, or continuous operation
+            self.setRx(rxTimeout)
 
         # set operation status to wait and attach RX interrupt handler
         if self._irq != -1 and intFlag :
@@ -810,6 +921,17 @@ class SX126x :
         # return array of bytes
         return bytes(buf)
 
+    def readPayload(self) -> bytes :
+
+        # read the whole received payload in a single buffer transaction
+        # payload length and buffer offset come from getRxBufferStatus stored by interrupt handler or wait()
+        length = self._payloadTxRx
+        if length == 0 : return b""
+        buf = self._readBytes(0x1E, length+1, (self._bufferIndex,), 1)
+        self._bufferIndex = (self._bufferIndex + length) % 256
+        self._payloadTxRx = 0
+        return bytes(buf[1:])
+
     def purge(self, length: int = 0) :
 
         # subtract or reset received payload length
@@ -819,6 +941,50 @@ class SX126x :
             self._payloadTxRx = 0
         self._bufferIndex += self._payloadTxRx
 
+### CHANNEL ACTIVITY DETECTION METHODS ###
+
+    def receiving(self) -> bool :
+
+        # check a packet is being received in RX mode: valid header latched and RX done not reported yet
+        irqStat = self.getIrqStatus()
+        return bool(irqStat & self.IRQ_HEADER_VALID) and not irqStat & self.IRQ_RX_DONE
+
+    def cad(self, symbolNum: int = CAD_ON_2_SYMB, detPeak: int = 0, detMin: int = 10) -> bool :
+
+        # channel activity detection, return True when LoRa preamble or payload is detected on the channel
+        # device is left in standby mode, call request() to receive again
+        # detection peak default is SF + 13, detection minimum 10
+        if detPeak == 0 : detPeak = self._sf + 13
+        # the whole CAD is a transaction, RX interrupt handler can't run between RX stop and CAD IRQ setup
+        with self.transaction() :
+            # RX interrupt handler must not take CAD interrupt
+            if self._irq != -1 : gpio.remove_event_detect(self._irq)
+            self.setStandby(self.STANDBY_RC)
+            # a packet received before standby would be cleared by CAD IRQ setup, hand it off to the RX handler
+            if self._statusWait == self.STATUS_RX_CONTINUOUS and self.getIrqStatus() & self.IRQ_RX_END :
+                self._interruptRxContinuous(self._irq)
+            self._statusWait = self.STATUS_CAD_WAIT
+            self._statusIrq = 0x0000
+            self._irqSetup(self.IRQ_CAD_DONE | self.IRQ_CAD_DETECTED)
+            self.setCadParams(symbolNum, detPeak, detMin, self.CAD_EXIT_STDBY, 0)
+            self.setCad()
+
+            # CAD lasts the configured symbols plus about one symbol of processing, timeout has twice that time
+            timeout = ((1 << symbolNum) + 1) * (1 << self._sf) / self._bw * 2 + 0.01
+            deadline = time.time() + timeout
+            irqStat = self.getIrqStatus()
+            while not irqStat & self.IRQ_CAD_DONE and time.time() < deadline :
+                if self._irq != -1 : gpio.wait_for_edge(self._irq, gpio.RISING, timeout=max(int((deadline - time.time()) * 1000), 1))
+                irqStat = self.getIrqStatus()
+            self.clearIrqStatus(0x03FF)
+
+            self._statusIrq = irqStat
+            if irqStat & self.IRQ_CAD_DETECTED :
+                self._statusWait = self.STATUS_CAD_DETECTED
+                return True
+            self._statusWait = self.STATUS_CAD_DONE
+            return False
+
 ### WAIT, OPERATION STATUS, AND PACKET STATUS METHODS ###
 
     def wait(self, timeout: int = 0) -> bool :
@@ -859,6 +1025,23 @@ class SX126x :
         self._statusIrq = irqStat
         return True
 
+    def waitTx(self, timeout: float) -> bool :
+
+        # block until TX interrupt handler reports TX done or TX timeout, without polling the device
+        # timeout in second, usually derived from time on air of transmitted packet
+        if self._txDone.wait(timeout) : return True
+        with self._lock :
+            # TX interrupt handler may have run while waiting for the lock, it stores IRQ status
+            if self._statusIrq : return True
+            # no interrupt received, TX is finished here and a late interrupt is ignored by the handler
+            self._statusWait = self.STATUS_DEFAULT
+            self._transmitTime = time.time() - self._transmitTime
+            # set back txen and rxen pin to previous state
+            if self._txen != -1 and self._rxen != -1 :
+                gpio.output(self._txen, self._txState)
+                gpio.output(self._rxen, self._rxState)
+        return False
+
     def status(self) -> int :
 
         # set back status IRQ for RX continuous operation
@@ -883,6 +1066,23 @@ class SX126x :
         # get transmit time in millisecond (ms)
         return self._transmitTime * 1000
 
+    def timeOnAir(self, payloadLength: int) -> float :
+
+        # calculate LoRa time on air in second of a package with configured modulation and packet parameters
+        # formula from Semtech SX126x datasheet section 6.1.4
+        sf = self._sf
+        tSym = (1 << sf) / self._bw
+        ih = 1 if self._headerType == self.HEADER_IMPLICIT else 0
+        crc = 1 if self._crcType else 0
+        if sf < 7 :
+            nPayload = math.ceil(max(8 * payloadLength + 16 * crc - 4 * sf + 20 * (1 - ih), 0) / (4 * sf))
+            nSymbol = self._preambleLength + 6.25 + 8 + nPayload * self._cr
+        else :
+            de = 1 if self._ldro else 0
+            nPayload = math.ceil(max(8 * payloadLength + 16 * crc - 4 * sf + 8 + 20 * (1 - ih), 0) / (4 * (sf - 2 * de)))
+            nSymbol = self._preambleLength + 4.25 + 8 + nPayload * self._cr
+        return nSymbol * tSym
+
     def dataRate(self) -> float :
 
         # get data rate last transmitted package in kbps
@@ -906,6 +1106,12 @@ class SX126x :
         (rssiPkt, snrPkt, signalRssiPkt) = self.getPacketStatus()
         return signalRssiPkt / -2.0
 
+    def packetStatus(self) -> PacketStatus :
+
+        # get RSSI, SNR, signal RSSI and frequency error of last incoming package in one snapshot
+        (rssiPkt, snrPkt, signalRssiPkt) = self.getPacketStatus()
+        return PacketStatus(rssiPkt, snrPkt, signalRssiPkt, self.getFreqError(), self._bw)
+
     def rssiInst(self) -> float :
 
         return self.getRssiInst() / -2.0
@@ -917,33 +1123,40 @@ class SX126x :
 
 ### INTERRUPT HANDLER METHODS ###
 
-    def _irqSetup(self, irqMask) :
+    def _irqSetup(self, irqMask, dioMask = None) :
 
         # clear IRQ status of previous transmit or receive operation
         self.clearIrqStatus(0x03FF)
-        # set selected interrupt source
+        # set selected interrupt source, IRQ in irqMask and not in dioMask are only latched in IRQ status
+        if dioMask is None : dioMask = irqMask
         dio1Mask = 0x0000
         dio2Mask = 0x0000
         dio3Mask = 0x0000
-        if self._dio == 2 : dio2Mask = irqMask
-        elif self._dio == 3 : dio3Mask = irqMask
-        else : dio1Mask = irqMask
+        if self._dio == 2 : dio2Mask = dioMask
+        elif self._dio == 3 : dio3Mask = dioMask
+        else : dio1Mask = dioMask
         self.setDioIrqParams(irqMask, dio1Mask, dio2Mask, dio3Mask)
 
     def _interruptTx(self, channel) :
 
-        # calculate transmit time
-        self._transmitTime = time.time() - self._transmitTime
-        # set back txen and rxen pin to previous state
-        if self._txen != -1 and self._rxen != -1 :
-            gpio.output(self._txen, self._txState)
-            gpio.output(self._rxen, self._rxState)
-        # store IRQ status
-        self._statusIrq = self.getIrqStatus()
+        with self._lock :
+            # return when no TX is pending: TX ended by waitTx() timeout, interrupt already handled,
+            # or a late interrupt of a previous TX while the next one is on air
+            irqStat = self.getIrqStatus()
+            if self._statusWait != self.STATUS_TX_WAIT or self._statusIrq or not irqStat & (self.IRQ_TX_DONE | self.IRQ_TIMEOUT) : return
+            # calculate transmit time, TX start is recorded by endPacket() before the lock is released
+            self._transmitTime = time.time() - self._transmitTime
+            # set back txen and rxen pin to previous state
+            if self._txen != -1 and self._rxen != -1 :
+                gpio.output(self._txen, self._txState)
+                gpio.output(self._rxen, self._rxState)
+            # store IRQ status
+            self._statusIrq = irqStat
 
-        # call onTransmit function
+        # call onTransmit function and wake up thread waiting for TX done
         if callable(self._onTransmit) :
             self._onTransmit()
+        if self._txDone is not None : self._txDone.set()
 
     def _interruptRx(self, channel) :
 
@@ -963,16 +1176,21 @@ class SX126x :
 
     def _interruptRxContinuous(self, channel) :
 
-        # store IRQ status
-        self._statusIrq = self.getIrqStatus()
-        # clear IRQ status
-        self.clearIrqStatus(0x03FF)
-        # get received payload length and buffer index
-        (self._payloadTxRx, self._bufferIndex) = self.getRxBufferStatus()
+        # packet is read under the lock, so cad() or a transmit can't clear IRQ status or overwrite buffer meanwhile
+        with self._lock :
+            irqStat = self.getIrqStatus()
+            # nothing to report when RX was stopped or the packet was already handed off by cad()
+            if self._statusWait != self.STATUS_RX_CONTINUOUS or not irqStat & self.IRQ_RX_END : return
+            # store IRQ status
+            self._statusIrq = irqStat
+            # clear IRQ status
+            self.clearIrqStatus(0x03FF)
+            # get received payload length and buffer index
+            (self._payloadTxRx, self._bufferIndex) = self.getRxBufferStatus()
 
-        # call onReceive function
-        if callable(self._onReceive) :
-            self._onReceive()
+            # call onReceive function
+            if callable(self._onReceive) :
+                self._onReceive()
 
     def onTransmit(self, callback) :
 
@@ -988,6 +1206,8 @@ class SX126x :
 
     def setSleep(self, sleepConfig: int) :
         self._writeBytes(0x84, (sleepConfig,), 1)
+        # configuration is lost in cold start sleep
+        if not sleepConfig & self.SLEEP_WARM_START : self._clearCmdCache()
 
     def setStandby(self, stbyConfig: int) :
         self._writeBytes(0x80, (stbyConfig,), 1)
@@ -1239,12 +1459,16 @@ class SX126x :
         self._writeBytes(0x07, buf, 2)
 
     def getFreqError(self)  -> tuple :
-        buf = self.readRegister(self.REG_OCP_CONFIGURATION, 3)
+        buf = self.readRegister(self.FREQ_ERROR, 3)
         return buf
 
 ### SX126X API: WORKAROUND FUNCTIONS ###
 
     def _fixLoRaBw500(self, bw: int) :
+        # workaround is applied once for configured bandwidth until configuration is lost
+        if self._cmdCache is not None :
+            if self._cmdCache.get("fixLoRaBw500") == bw : return
+            self._cmdCache["fixLoRaBw500"] = bw
         packetType = self.getPakcetType()
         buf = self.readRegister(self.REG_TX_MODULATION, 1)
         value = buf[0] | 0x04
@@ -1273,15 +1497,33 @@ class SX126x :
 ### SX126X API: UTILITIES ###
 
     def _writeBytes(self, opCode: int, data: tuple, nBytes: int) :
-        if self.busyCheck() : return
         buf = [opCode]
-        for i in range(nBytes) : buf.append(data[i])
+        buf.extend(data[:nBytes])
+        with self._lock :
+            # skip configuration command when parameters are the same of last sent
+            if self._cmdCache is not None and opCode in self.CACHED_OPCODES :
+                if self._cmdCache.get(opCode) == buf : return
+                if opCode == 0x8A :
+                    # modulation and packet parameters must be sent again after packet type change
+                    self._cmdCache.pop(0x8B, None)
+                    self._cmdCache.pop(0x8C, None)
+                self._cmdCache[opCode] = buf
+            if not self._transfer(buf) :
+                # command is lost, parameters cache is not reliable anymore
+                self._clearCmdCache()
+
+    def _transfer(self, buf: list) -> bool :
+        if self.busyCheck() : return False
         spi.xfer2(buf)
+        # next busy check will wait for a long operation
+        if buf[0] in self.BUSY_LONG_OPCODES : self._busyLongOp = True
+        return True
 
     def _readBytes(self, opCode: int, nBytes: int, address: tuple = (), nAddress: int = 0) -> tuple :
-        if self.busyCheck() : return ()
         buf = [opCode]
-        for i in range(nAddress) : buf.append(address[i])
-        for i in range(nBytes) : buf.append(0x00)
-        feedback = spi.xfer2(buf)
+        buf.extend(address[:nAddress])
+        buf.extend(bytes(nBytes))
+        with self._lock :
+            if self.busyCheck() : return ()
+            feedback = spi.xfer2(buf)
         return tuple(feedback[nAddress+1:])
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Functional check of the TNC on the simulated radio (hardware = "sim").
+# The TNC and the KISS server are started like in Benchmark.py and a KISS client
+# is connected over TCP:
+#   RX:  a frame injected in the radio is delivered to the client
+#   TX:  a KISS frame written by the client is transmitted, then the radio is back in RX
+#   CAD: the channel is busy while CAD sees activity and free otherwise, then the radio is back in RX
+#   RX before CAD: a frame received while the scheduler thread holds the radio is delivered once
+#   late TX done: a TX done interrupt coming after the TX timeout doesn't end the TX of the next frame
+# Each TNC class runs in its own process, the exit status is 1 if a check fails.
+#
+# Usage: python3 SimTest.py [--tnc sx126x|sx127x] [--port 10201]
+#
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import config
+from Benchmark import TNCS, KissClient, start_tnc
+
+TIMEOUT = 2.0  # max wait for each check, in seconds
+
+def wait(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def rx_frame(sequence):
+    return b"<\xff\x01N0CALL-1>APRS,WIDE1-1:>simtest #%06d" % sequence
+
+def received(radio, client, sequence):
+    # the frame is injected as soon as the radio is in RX and must reach the client
+    return wait(radio.receiving) and radio.inject(rx_frame(sequence)) and wait(lambda: sequence in client.received)
+
+def run(tnc, port):
+    # runs in the child process of one TNC class, returns the number of failed checks
+    config.hardware = "sim"
+    config.sx127x = tnc == "sx127x"
+    config.log_enable = False
+    config.CAD = True
+    config.spreadingFactor = 7 # short TX timeouts
+    import Logger
+    Logger.set_level(Logger.WARNING)
+    import Simulator
+    Simulator.airtimeScale = 0.1
+    import KissHelper
+    from Frame import Frame
+    lora, server = start_tnc(tnc, port)
+    radio = Simulator.radio()
+    client = KissClient("127.0.0.1", port)
+    client.start()
+    wait(lambda: lora.scheduler is not None and server.stats())
+    failed = []
+    def check(name, ok):
+        print("%s %-12s %s" % (tnc, name, "ok" if ok else "FAILED"))
+        if not ok:
+            failed.append(name)
+
+    check("RX", received(radio, client, 1))
+
+    transmitted = []
+    radio.onTransmit = transmitted.append
+    tx_frame = lambda sequence: KissHelper.encode_kiss_OE(Frame(b"N0CALL-2>APRS:>simtest #%06d" % sequence, Frame.TX, True))
+    client.send(tx_frame(2))
+    check("TX", wait(lambda: any(b"#000002" in payload for payload in transmitted)))
+    check("RX after TX", received(radio, client, 3))
+
+    # channelBusy() is called by the TX scheduler, the queue is empty so it's called here without interference
+    cads = radio.cads
+    radio.cadActive = True
+    busy = lora.channelBusy()
+    radio.cadActive = False
+    check("CAD busy", busy and radio.cads == cads + 1)
+    check("CAD free", not lora.channelBusy() and radio.cads == cads + 2)
+    check("RX after CAD", received(radio, client, 4))
+
+    # the RX interrupt waits for the radio lock taken like by the TX scheduler, channelBusy() passes the frame to the RX handler
+    lock = lora.lock if tnc == "sx127x" else lora._lock
+    frames_out = lambda: server.stats()[0]["frames_out"]
+    frames = frames_out()
+    with lock:
+        radio.inject(rx_frame(5))
+        time.sleep(0.05)
+        lora.channelBusy()
+    check("RX before CAD", wait(lambda: 5 in client.received) and not wait(lambda: frames_out() > frames + 1, 0.2))
+    check("RX after it", received(radio, client, 6))
+
+    # the IRQ thread is held until the second frame is on air: the TX done interrupt of the first one
+    # comes after its TX timeout, while the second one is transmitted
+    Simulator.airtimeScale = 1.0
+    completed = radio.completed
+    count = len(transmitted)
+    Simulator.gpio.events.put((lambda pin: wait(lambda: len(transmitted) >= count + 2, 5.0), None))
+    client.send(tx_frame(7) + tx_frame(8))
+    check("late TX done", wait(lambda: radio.completed == completed + 2, 5.0))
+    Simulator.airtimeScale = 0.1
+    check("RX after it", received(radio, client, 9))
+
+    client.close()
+    return len(failed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Functional check of the TNC on the simulated radio")
+    parser.add_argument("--tnc", choices=TNCS, help="check only this TNC class")
+    parser.add_argument("--port", type=int, default=10201)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        failed = run(args.tnc, args.port)
+        sys.stdout.flush()
+        os._exit(1 if failed else 0) # TNC threads don't stop
+
+    status = 0
+    for i, tnc in enumerate([args.tnc] if args.tnc else TNCS):
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--tnc", tnc, "--port", str(args.port + i)])
+        if child.returncode:
+            print("%s: FAILED" % tnc)
+            status = 1
+    sys.exit(status)
@@ -0,0 +1,528 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Simulated hardware backend, selected with hardware = "sim" in config.py.
+# It replaces RPi.GPIO and spidev with software models of the SX126x and SX127x
+# radios, so that TNC, KISS server and codec run on any Linux host.
+#
+# The models answer the SPI commands and registers used by SX126x.py and LoRa.py,
+# raise the IRQ pin like the real chip and keep the radio in TX for the time on air
+# of the frame. The BUSY pin of SX126x is always low.
+#
+# Received frames are injected with radio().inject(payload), transmitted frames are
+# collected in radio().transmitted and passed to the radio().onTransmit callback.
+# radio().channelActive = True simulates another station on air, seen by CAD and signal detection.
+# radio().cadActive = True simulates activity seen by CAD only, e.g. a preamble not detected by the receiver yet.
+
+import time
+import threading
+from collections import deque
+from queue import SimpleQueue
+from Airtime import time_on_air
+import config
+
+airtimeScale = 1.0  # time on air multiplier, benchmarks can shorten simulated TX and RX
+
+
+class SimGpio:
+    '''Subset of RPi.GPIO API on simulated pins. Edge callbacks run in one event thread, like RPi.GPIO'''
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}   # pin: (edge, callback)
+        self.watchers = {}    # pin: function called with the new level when the pin is written, used by radio models
+        self.edge = threading.Condition()
+        self.events = SimpleQueue()
+        self.thread = None
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+        self.levels.setdefault(pin, initial if direction == self.OUT else self.LOW)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self.callbacks.clear()
+        else:
+            self.callbacks.pop(pin, None)
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        value = self.HIGH if value else self.LOW
+        self.levels[pin] = value
+        watcher = self.watchers.get(pin)
+        if watcher:
+            watcher(value)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._dispatch, name="SimGpio", daemon=True)
+            self.thread.start()
+
+    def add_event_callback(self, pin, callback):
+        edge = self.callbacks.get(pin, (self.BOTH, None))[0]
+        self.add_event_detect(pin, edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def wait_for_edge(self, pin, edge, timeout=None):
+        # timeout in ms like RPi.GPIO, returns pin number or None on timeout
+        expected = self.HIGH if edge == self.RISING else self.LOW
+        with self.edge:
+            if self.edge.wait_for(lambda: self.levels.get(pin) == expected, None if timeout is None else timeout / 1000):
+                return pin
+        return None
+
+    def drive(self, pin, level):
+        # level of an input pin set by a radio model, edge callbacks are queued to the event thread
+        level = self.HIGH if level else self.LOW
+        with self.edge:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+            self.edge.notify_all()
+        if level == previous:
+            return
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback and edge in (self.BOTH, self.RISING if level else self.FALLING):
+            self.events.put((callback, pin))
+
+    def watch(self, pin, function):
+        self.watchers[pin] = function
+
+    def _dispatch(self):
+        while True:
+            callback, pin = self.events.get()
+            try:
+                callback(pin)
+            except Exception as e:
+                # RPi.GPIO prints callback exceptions and keeps running
+                import traceback
+                traceback.print_exc()
+
+
+class SimSpiDev:
+    '''Subset of spidev.SpiDev API, transfers are answered by the simulated radio'''
+
+    def __init__(self):
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.lsbfirst = False
+        self.bus = None
+        self.device = None
+
+    def open(self, bus, device):
+        self.bus = bus
+        self.device = device
+
+    def close(self):
+        pass
+
+    def xfer(self, data):
+        # spidev sends the low byte of each value
+        return radio().transfer([value & 0xFF for value in data])
+
+    xfer2 = xfer
+
+
+class SimRadio:
+    '''Common part of the radio models: IRQ pin, TX airtime and injected RX frames'''
+
+    def __init__(self, gpio, irqPin):
+        self.gpio = gpio
+        self.irqPin = irqPin
+        self.lock = threading.RLock()
+        self.onTransmit = None         # called with the payload of each transmitted frame
+        self.transmitted = deque(maxlen=1000)
+        self.channelActive = False     # other stations transmitting, seen by signal detection and CAD
+        self.cadActive = False         # activity seen by CAD only
+        self.rxActive = False          # injected frame on air
+        self.timer = None              # end of TX or CAD
+        self.received = 0
+        self.missed = 0                # injected frames not received because the radio was not in RX
+        self.cads = 0                  # channel activity detections started
+        self.completed = 0             # transmissions that lasted their whole time on air, not aborted by a mode change
+
+    def airtime(self, payloadLength):
+        return time_on_air(payloadLength, *self.modulation()) * airtimeScale
+
+    def startTx(self, payload):
+        payload = bytes(payload)
+        self.transmitted.append(payload)
+        if self.onTransmit:
+            self.onTransmit(payload)
+        self.timer = threading.Timer(self.airtime(len(payload)), self._txDone)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancelTimer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def _txDone(self):
+        with self.lock:
+            self.timer = None
+            self.completed += 1
+            self.txDone()
+
+    def startCad(self, symbols):
+        # CAD lasts the given symbols plus about one symbol of processing
+        sf, bw = self.modulation()[:2]
+        self.cads += 1
+        self.timer = threading.Timer((symbols + 1) * (1 << sf) / bw * airtimeScale, self._cadDone)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _cadDone(self):
+        with self.lock:
+            self.timer = None
+            self.cadDone(self.signal() or self.cadActive)
+
+    def signal(self):
+        return self.channelActive or self.rxActive
+
+    def inject(self, payload, rssi=-100, snr=8.0, freqError=0, crcError=False, airtime=False):
+        # frame received from air. With airtime=True the IRQ is raised after the frame time on air,
+        # meanwhile the signal is seen by CAD and by the receiver
+        if airtime:
+            with self.lock:
+                self.rxActive = True
+                if self.receiving():
+                    self.rxStart()
+            time.sleep(self.airtime(len(payload)))
+        with self.lock:
+            self.rxActive = False
+            if not self.receiving():
+                self.missed += 1
+                return False
+            self.received += 1
+            self.rxDone(bytes(payload), rssi, snr, freqError, crcError)
+        return True
+
+
+class SX126xModel(SimRadio):
+    '''SX126x command interface'''
+
+    BW = {0x00: 7800, 0x08: 10400, 0x01: 15600, 0x09: 20800, 0x02: 31250, 0x0A: 41700,
+          0x03: 62500, 0x04: 125000, 0x05: 250000, 0x06: 500000}
+    MODE_STDBY_RC = 0x2
+    MODE_RX = 0x5
+    MODE_TX = 0x6
+    FREQ_ERROR = 0x076B
+    # opcodes reading data, with number of address bytes
+    READ_OPCODES = {0x1D: 2, 0x1E: 1, 0x10: 0, 0x11: 0, 0x12: 0, 0x13: 0, 0x14: 0, 0x15: 0, 0x17: 0, 0xC0: 0}
+
+    def __init__(self, gpio, irqPin, resetPin):
+        SimRadio.__init__(self, gpio, irqPin)
+        gpio.watch(resetPin, self._resetPin)
+        self.reset()
+
+    def reset(self):
+        self.cancelTimer()
+        self.mode = self.MODE_STDBY_RC
+        self.registers = bytearray(0x1000)
+        self.buffer = bytearray(256)
+        self.irq = 0
+        self.irqMask = 0
+        self.dio1Mask = 0
+        self.sf, self.bw, self.cr, self.ldro = 7, 125000, 5, False
+        self.preamble, self.explicitHeader, self.payloadLength, self.crc = 12, True, 32, False
+        self.cadSymbols = 1
+        self.txBase = 0
+        self.rxBase = 0
+        self.rxStatus = (0, 0)
+        self.packetStatus = (0, 0, 0)
+        self.gpio.drive(self.irqPin, 0)
+
+    def _resetPin(self, level):
+        if level:
+            with self.lock:
+                self.reset()
+
+    def modulation(self):
+        return (self.sf, self.bw, self.cr, self.preamble, self.explicitHeader, self.crc, self.ldro)
+
+    def status(self):
+        return self.mode << 4
+
+    def receiving(self):
+        return self.mode == self.MODE_RX
+
+    def setIrq(self, flags):
+        self.irq |= flags & self.irqMask
+        if self.irq & self.dio1Mask:
+            self.gpio.drive(self.irqPin, 1)
+
+    def txDone(self):
+        self.mode = self.MODE_STDBY_RC
+        self.setIrq(0x0001)
+
+    def cadDone(self, detected):
+        self.mode = self.MODE_STDBY_RC
+        self.setIrq(0x0080 | (0x0100 if detected else 0))
+
+    def rxStart(self):
+        self.setIrq(0x0010) # header valid
+
+    def rxDone(self, payload, rssi, snr, freqError, crcError):
+        self.buffer[self.rxBase:self.rxBase + len(payload)] = payload
+        del self.buffer[256:]
+        self.rxStatus = (len(payload), self.rxBase)
+        self.packetStatus = (int(-rssi * 2) & 0xFF, int(snr * 4) & 0xFF, int(-rssi * 2) & 0xFF)
+        efe = int(freqError * (1600 / (self.bw / 1000)) / 1.55) & 0x0FFFFF
+        self.registers[self.FREQ_ERROR:self.FREQ_ERROR + 3] = bytes(((efe >> 16) & 0xFF, (efe >> 8) & 0xFF, efe & 0xFF))
+        self.setIrq(0x0002 | (0x0040 if crcError else 0))
+
+    def transfer(self, buf):
+        with self.lock:
+            opcode = buf[0]
+            status = self.status()
+            out = [status] * len(buf)
+            nAddress = self.READ_OPCODES.get(opcode)
+            if nAddress is not None:
+                data = self.read(opcode, buf[1:1 + nAddress], len(buf) - 2 - nAddress)
+                out[2 + nAddress:] = data
+            else:
+                self.write(opcode, buf[1:])
+            return out
+
+    def read(self, opcode, address, n):
+        if opcode == 0x1D:
+            start = address[0] << 8 | address[1]
+            return list(self.registers[start:start + n])
+        if opcode == 0x1E:
+            start = address[0]
+            return [self.buffer[(start + i) % 256] for i in range(n)]
+        if opcode == 0x12:
+            data = [self.irq >> 8, self.irq & 0xFF]
+        elif opcode == 0x13:
+            data = list(self.rxStatus)
+        elif opcode == 0x14:
+            data = list(self.packetStatus)
+        elif opcode == 0x11:
+            data = [0x01]
+        elif opcode == 0x15:
+            data = [self.packetStatus[0]]
+        else:
+            data = []
+        return (data + [0] * n)[:n]
+
+    def write(self, opcode, data):
+        if opcode == 0x80: # setStandby
+            self.cancelTimer()
+            self.mode = self.MODE_STDBY_RC
+        elif opcode == 0x82: # setRx
+            self.cancelTimer()
+            self.mode = self.MODE_RX
+        elif opcode == 0x83: # setTx
+            self.mode = self.MODE_TX
+            self.startTx(bytes(self.buffer[(self.txBase + i) % 256] for i in range(self.payloadLength)))
+        elif opcode == 0xC5: # setCad
+            self.cancelTimer()
+            self.mode = self.MODE_STDBY_RC
+            self.startCad(self.cadSymbols)
+        elif opcode == 0x88: # setCadParams
+            self.cadSymbols = 1 << data[0]
+        elif opcode == 0x02: # clearIrqStatus
+            self.irq &= ~(data[0] << 8 | data[1])
+            if not self.irq & self.dio1Mask:
+                self.gpio.drive(self.irqPin, 0)
+        elif opcode == 0x08: # setDioIrqParams
+            self.irqMask = data[0] << 8 | data[1]
+            self.dio1Mask = data[2] << 8 | data[3]
+        elif opcode == 0x0D: # writeRegister
+            start = data[0] << 8 | data[1]
+            self.registers[start:start + len(data) - 2] = bytes(data[2:])
+        elif opcode == 0x0E: # writeBuffer
+            for i, value in enumerate(data[1:]):
+                self.buffer[(data[0] + i) % 256] = value
+        elif opcode == 0x8B: # setModulationParams
+            self.sf = data[0]
+            self.bw = self.BW.get(data[1], 125000)
+            self.cr = data[2] + 4
+            self.ldro = bool(data[3])
+        elif opcode == 0x8C: # setPacketParams
+            self.preamble = data[0] << 8 | data[1]
+            self.explicitHeader = data[2] == 0
+            self.payloadLength = data[3]
+            self.crc = bool(data[4])
+        elif opcode == 0x8F: # setBufferBaseAddress
+            self.txBase, self.rxBase = data[0], data[1]
+        # other configuration commands are accepted without effect
+
+
+class SX127xModel(SimRadio):
+    '''SX127x register interface in LoRa mode'''
+
+    BW = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+    FIFO = 0x00
+    OP_MODE = 0x01
+    FIFO_ADDR_PTR = 0x0D
+    FIFO_TX_BASE_ADDR = 0x0E
+    FIFO_RX_BASE_ADDR = 0x0F
+    FIFO_RX_CURR_ADDR = 0x10
+    IRQ_FLAGS = 0x12
+    RX_NB_BYTES = 0x13
+    MODEM_STAT = 0x18
+    PKT_SNR_VALUE = 0x19
+    PKT_RSSI_VALUE = 0x1A
+    MODEM_CONFIG_1 = 0x1D
+    MODEM_CONFIG_2 = 0x1E
+    PREAMBLE_MSB = 0x20
+    PAYLOAD_LENGTH = 0x22
+    MODEM_CONFIG_3 = 0x26
+    FEI_MSB = 0x28
+    DIO_MAPPING_1 = 0x40
+    VERSION = 0x42
+    MODE_STDBY = 0x01
+    MODE_TX = 0x03
+    MODE_RXCONT = 0x05
+    MODE_RXSINGLE = 0x06
+    MODE_CAD = 0x07
+
+    def __init__(self, gpio, irqPin):
+        SimRadio.__init__(self, gpio, irqPin)
+        self.registers = bytearray(0x80)
+        self.registers[self.OP_MODE] = 0x09
+        self.registers[self.MODEM_CONFIG_1] = 0x72
+        self.registers[self.MODEM_CONFIG_2] = 0x70
+        self.registers[self.PREAMBLE_MSB + 1] = 0x08
+        self.registers[self.PAYLOAD_LENGTH] = 0x01
+        self.registers[self.VERSION] = 0x12
+        self.fifo = bytearray(256)
+
+    def modulation(self):
+        r = self.registers
+        return (r[self.MODEM_CONFIG_2] >> 4, self.BW[min(r[self.MODEM_CONFIG_1] >> 4, 9)], ((r[self.MODEM_CONFIG_1] >> 1) & 0x07) + 4,
+                r[self.PREAMBLE_MSB] << 8 | r[self.PREAMBLE_MSB + 1], not r[self.MODEM_CONFIG_1] & 0x01,
+                bool(r[self.MODEM_CONFIG_2] & 0x04), bool(r[self.MODEM_CONFIG_3] & 0x08))
+
+    def receiving(self):
+        return self.registers[self.OP_MODE] & 0x07 in (self.MODE_RXCONT, self.MODE_RXSINGLE)
+
+    def dio0(self):
+        # DIO0 follows RxDone, TxDone or CadDone depending on mapping
+        flag = (0x40, 0x08, 0x04, 0x00)[self.registers[self.DIO_MAPPING_1] >> 6]
+        self.gpio.drive(self.irqPin, self.registers[self.IRQ_FLAGS] & flag)
+
+    def txDone(self):
+        self.registers[self.OP_MODE] = (self.registers[self.OP_MODE] & 0xF8) | self.MODE_STDBY
+        self.registers[self.IRQ_FLAGS] |= 0x08
+        self.dio0()
+
+    def cadDone(self, detected):
+        self.registers[self.OP_MODE] = (self.registers[self.OP_MODE] & 0xF8) | self.MODE_STDBY
+        self.registers[self.IRQ_FLAGS] |= 0x04 | (0x01 if detected else 0)  # CadDone, CadDetected
+        self.dio0()
+
+    def rxStart(self):
+        pass # signal detected is read from MODEM_STAT
+
+    def rxDone(self, payload, rssi, snr, freqError, crcError):
+        r = self.registers
+        start = r[self.FIFO_RX_BASE_ADDR]
+        for i, value in enumerate(payload):
+            self.fifo[(start + i) % 256] = value
+        r[self.FIFO_RX_CURR_ADDR] = start
+        r[self.RX_NB_BYTES] = len(payload)
+        r[self.PKT_SNR_VALUE] = int(snr * 4) & 0xFF
+        r[self.PKT_RSSI_VALUE] = max(0, min(255, int(rssi + 164)))
+        fei = int(freqError * 32e6 / (1 << 24) / (self.modulation()[1] / 1000 / 500)) & 0x0FFFFF
+        r[self.FEI_MSB:self.FEI_MSB + 3] = bytes(((fei >> 16) & 0x0F, (fei >> 8) & 0xFF, fei & 0xFF))
+        r[self.IRQ_FLAGS] |= 0x50 | (0x20 if crcError else 0)  # RxDone, ValidHeader, PayloadCrcError
+        if r[self.OP_MODE] & 0x07 == self.MODE_RXSINGLE:
+            r[self.OP_MODE] = (r[self.OP_MODE] & 0xF8) | self.MODE_STDBY
+        self.dio0()
+
+    def transfer(self, buf):
+        with self.lock:
+            address = buf[0] & 0x7F
+            write = buf[0] & 0x80
+            out = [0] * len(buf)
+            r = self.registers
+            for i, value in enumerate(buf[1:], 1):
+                if address == self.FIFO:
+                    # FIFO access uses and increments the FIFO pointer, the register address doesn't change
+                    pointer = r[self.FIFO_ADDR_PTR]
+                    if write:
+                        self.fifo[pointer] = value
+                    else:
+                        out[i] = self.fifo[pointer]
+                    r[self.FIFO_ADDR_PTR] = (pointer + 1) % 256
+                    continue
+                out[i] = r[address]
+                if write:
+                    self.writeRegister(address, value)
+                elif address == self.MODEM_STAT:
+                    out[i] = 0x01 if self.signal() else 0x00  # signal detected
+                address = (address + 1) % 0x80
+            return out
+
+    def writeRegister(self, address, value):
+        r = self.registers
+        if address == self.IRQ_FLAGS:
+            # writing 1 clears the flag
+            r[address] &= ~value & 0xFF
+            self.dio0()
+        elif address == self.OP_MODE:
+            r[address] = value
+            self.cancelTimer()
+            if value & 0x07 == self.MODE_TX:
+                start = r[self.FIFO_TX_BASE_ADDR]
+                self.startTx(bytes(self.fifo[(start + i) % 256] for i in range(r[self.PAYLOAD_LENGTH])))
+            elif value & 0x07 == self.MODE_CAD:
+                self.startCad(1)
+        elif address == self.DIO_MAPPING_1:
+            r[address] = value
+            self.dio0()
+        elif address not in (self.FIFO_RX_CURR_ADDR, self.RX_NB_BYTES, self.MODEM_STAT, self.VERSION):
+            r[address] = value
+
+
+gpio = SimGpio()
+_radio = None
+
+def radio():
+    # radio model selected by config.sx127x, created on first use
+    global _radio
+    if _radio is None:
+        if config.sx127x:
+            _radio = SX127xModel(gpio, config.irqPin)
+        else:
+            _radio = SX126xModel(gpio, config.irqPin, config.resetPin)
+    return _radio
+
+def SpiDev():
+    return SimSpiDev()
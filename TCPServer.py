@@ -15,116 +15,458 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import sys
+import os
+import stat
+import tty
 from threading import Thread
 import socket
+import asyncio
+import time
+from collections import deque
+import traceback
 from KissHelper import SerialParser
 import KissHelper
+from KissHelper import (KISS_CMD_DATA, KISS_CMD_TXDELAY, KISS_CMD_P, KISS_CMD_SLOTTIME, KISS_CMD_TXTAIL,
+                        KISS_CMD_FULLDUPLEX, KISS_CMD_SETHARDWARE, KISS_CMD_RETURN)
+from Frame import Frame
 import config
-import datetime
+from Logger import logf, log_enabled, DEBUG, ERROR
 
-def logf(message):
-    timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S - ')
-    if config.log_enable:
-       fileLog = open(config.logpath,"a")
-       fileLog.write(timestamp + message+"\n")
-       fileLog.close()
-    print(timestamp + message+"\n")
+LISTEN_BACKLOG = 8
+WRITE_BUFFER_HIGH = 4096 # bytes in the socket transport above which frames wait in the client queue
 
-client_address = []
-RECV_BUFFER_LENGTH = 1024
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+DROP_DISCONNECT = "disconnect"
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, DROP_DISCONNECT)
+
+def apply_socket_options(sock): #socket options from config, for the listening socket and each client socket
+    if config.KISS_SNDBUF:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.KISS_SNDBUF)
+    if config.KISS_RCVBUF:
+        # on the listening socket it must be set before listen(), it determines the TCP window scale
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.KISS_RCVBUF)
+    if sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if config.KISS_TCP_NODELAY else 0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1 if config.KISS_KEEPALIVE else 0)
+    if config.KISS_KEEPALIVE:
+        # keepalive timings are not available on every platform
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, config.KISS_KEEPALIVE_IDLE)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, config.KISS_KEEPALIVE_INTERVAL)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, config.KISS_KEEPALIVE_COUNT)
+
+class KissClient:
+    '''KISS client connected to the server, with its stream writer and counters'''
+
+    __slots__ = ('reader', 'writer', 'name', 'persistent', 'connected', 'queue', 'ready',
+                 'frames_in', 'frames_out', 'bytes_in', 'bytes_out', 'invalid', 'dropped', 'commands')
+
+    def __init__(self, reader, writer, name, persistent=False):
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.persistent = persistent  # endpoint that is never disconnected by the server, like the PTY
+        self.queue = deque()          # encoded frames waiting to be written, bounded by the server
+        self.ready = asyncio.Event()  # set when frames are added to the queue
+        self.connected = time.time()
+        self.frames_in = 0   # KISS frames received from the client and queued for TX
+        self.frames_out = 0  # KISS frames sent to the client
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.invalid = 0     # KISS frames from the client that could not be decoded
+        self.dropped = 0     # KISS frames not sent because the client queue was full
+        self.commands = 0    # KISS command frames received from the client
+
+    def stats(self):
+        return dict(
+                name       = self.name,
+                connected  = self.connected,
+                frames_in  = self.frames_in,
+                frames_out = self.frames_out,
+                bytes_in   = self.bytes_in,
+                bytes_out  = self.bytes_out,
+                invalid    = self.invalid,
+                dropped    = self.dropped,
+                commands   = self.commands,
+                queued     = len(self.queue)
+            )
 
 class KissServer(Thread):
-    '''TCP Server to be connected by the APRS digipeater'''
+    '''KISS TCP Server to be connected by the APRS digipeater and other KISS clients.
+    Clients are served by an asyncio loop running in this thread. Frames received from radio
+    are sent to all clients through a bounded queue per client, frames from any client are queued for TX.
+    Optionally the same service is offered on an unix domain socket and on a pseudo terminal'''
 
     txQueue = None
+    scheduler = None  # TxScheduler receiving channel access KISS commands, set by the TNC
 
     # host and port as configured in aprx/aprx.conf.lora-aprs < interface > section
-    def __init__(self, txQueue, host="127.0.0.1", port=bytes(10001)):
+    # unixPath and ptyLink default to KISS_UNIX_SOCKET and KISS_PTY_LINK in config.py
+    def __init__(self, txQueue, host="127.0.0.1", port=10001, unixPath=None, ptyLink=None):
         Thread.__init__(self)
+        # listening sockets and PTY are created here, so that configuration errors are raised at startup
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        apply_socket_options(self.socket)
         self.socket.bind((host, port))
-        self.socket.listen(1)
-        self.data = str()
+        self.socket.listen(LISTEN_BACKLOG)
+        self.unixPath = config.KISS_UNIX_SOCKET if unixPath is None else unixPath
+        self.unixSocket = None
+        if self.unixPath:
+            # a socket file left by a previous run would make bind() fail
+            if os.path.exists(self.unixPath) and stat.S_ISSOCK(os.stat(self.unixPath).st_mode):
+                os.unlink(self.unixPath)
+            self.unixSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            apply_socket_options(self.unixSocket)
+            self.unixSocket.bind(self.unixPath)
+            self.unixSocket.listen(LISTEN_BACKLOG)
+        self.ptyLink = config.KISS_PTY_LINK if ptyLink is None else ptyLink
+        self.ptyMaster = None
+        if self.ptyLink:
+            self.ptyMaster, self.ptySlave = os.openpty()
+            # raw mode, KISS bytes must not be translated or echoed by the line discipline
+            tty.setraw(self.ptySlave)
+            os.set_blocking(self.ptyMaster, False)
+            if os.path.islink(self.ptyLink):
+                os.unlink(self.ptyLink)
+            os.symlink(os.ttyname(self.ptySlave), self.ptyLink)
         self.txQueue = txQueue
-        self.connection = None
+        self.recvSize = config.KISS_RECV_SIZE
+        self.clients = set()
+        self.clientQueueSize = config.KISS_CLIENT_QUEUE
+        self.dropPolicy = config.KISS_DROP_POLICY
+        if self.dropPolicy not in DROP_POLICIES:
+            logf("KISS-Server: invalid drop policy "+repr(self.dropPolicy)+", using "+DROP_OLDEST, ERROR)
+            self.dropPolicy = DROP_OLDEST
+        self.loop = asyncio.new_event_loop()
         logf("KISS-Server: Started. Listening on IP "+host+" Port: "+str(port))
+        if self.unixSocket:
+            logf("KISS-Server: Listening on unix socket "+self.unixPath)
+        if self.ptyMaster is not None:
+            logf("KISS-Server: PTY "+os.ttyname(self.ptySlave)+" linked to "+self.ptyLink)
 
     def run(self):
-        global client_address
-        parser = SerialParser(self.queue_frame)
-        while True:
-            self.connection = None
-            self.connection, client_address = self.socket.accept()
-            parser.reset()
-            logf("KISS-Server: Accepted Connection from %s" % client_address[0])
+        asyncio.set_event_loop(self.loop)
+        servers = [self.loop.run_until_complete(asyncio.start_server(self.handle_client, sock=self.socket))]
+        if self.unixSocket:
+            servers.append(self.loop.run_until_complete(asyncio.start_unix_server(self.handle_unix_client, sock=self.unixSocket)))
+        if self.ptyMaster is not None:
+            self.loop.create_task(self.serve_pty())
+        try:
+            self.loop.run_forever()
+        finally:
+            for server in servers:
+                server.close()
+            # end of input stops the client handlers, which close the connections and cancel their writer tasks
+            for client in list(self.clients):
+                client.reader.feed_eof()
+            self.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.loop), return_exceptions=True))
+            for server in servers:
+                self.loop.run_until_complete(server.wait_closed())
+            if self.unixSocket:
+                os.unlink(self.unixPath)
+            if self.ptyMaster is not None:
+                os.unlink(self.ptyLink)
+                os.close(self.ptyMaster)
+                os.close(self.ptySlave)
+
+    async def handle_client(self, reader, writer): #TCP connection
+        # options are set again on the client socket, not all of them are inherited from the listening socket
+        apply_socket_options(writer.get_extra_info("socket"))
+        peer = writer.get_extra_info("peername")
+        await self.serve_client(reader, writer, "%s:%s" % peer[0:2])
+
+    async def handle_unix_client(self, reader, writer): #unix domain socket connection, peers have no address
+        sock = writer.get_extra_info("socket")
+        apply_socket_options(sock)
+        await self.serve_client(reader, writer, "unix:%s#%i" % (self.unixPath, sock.fileno()))
+
+    async def serve_pty(self):
+        # the PTY master is served like a connection that never closes: the slave side is kept open
+        # by the server, so reads never fail when no program has the device open
+        reader = asyncio.StreamReader(loop=self.loop)
+        readTransport, _ = await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=self.loop),
+                                                             os.fdopen(self.ptyMaster, "rb", buffering=0, closefd=False))
+        writeTransport, writeProtocol = await self.loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                                           os.fdopen(self.ptyMaster, "wb", buffering=0, closefd=False))
+        writer = asyncio.StreamWriter(writeTransport, writeProtocol, reader, self.loop)
+        try:
+            await self.serve_client(reader, writer, "pty:" + self.ptyLink, persistent=True)
+        finally:
+            readTransport.close()
+
+    async def serve_client(self, reader, writer, name, persistent=False): #framing and fan-out shared by all transports
+        client = KissClient(reader, writer, name, persistent)
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.clients.add(client)
+        writerTask = self.loop.create_task(self.write_client(client))
+        logf("KISS-Server: Accepted Connection from %s" % client.name)
+        # every client has its own parser, partial frames of different clients are never mixed
+        parser = SerialParser(lambda frame: self.queue_frame(frame, client))
+        try:
             while True:
-                data = self.connection.recv(RECV_BUFFER_LENGTH)
-                if data:
-                    parser.parse(data)
-                else:
-                    logf("KISS-Server: Closed Connection from %s" % client_address[0])
-                    self.connection.close()
+                data = await reader.read(self.recvSize)
+                if not data:
                     break
+                client.bytes_in += len(data)
+                parser.parse(data)
+        except OSError as e:
+            logf("KISS-Server: Connection error from %s: %s" % (client.name, e), ERROR)
+        finally:
+            self.clients.discard(client)
+            writerTask.cancel()
+            writer.close()
+            logf("KISS-Server: Closed Connection from %s" % client.name)
 
-    def queue_frame(self, frame, verbose=True):
-        logf("Received from IP: "+str(client_address[0])+" KISS Frame: "+repr(frame))
-        if config.TX_OE_Style:
-            decoded_data = KissHelper.decode_kiss_OE(frame)
-        else:
-            decoded_data = KissHelper.decode_kiss_AX25(frame)
-        #logf("Decapsulated Kiss Frame :"+ repr(decoded_data))
+    async def write_client(self, client): #drains the client queue, waiting while the socket buffer is full
+        writer = client.writer
+        queue = client.queue
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while queue:
+                    data = queue.popleft()
+                    writer.write(data)
+                    client.frames_out += 1
+                    client.bytes_out += len(data)
+                    await writer.drain()
+        except OSError as e:
+            logf("KISS-Server: Write error to %s: %s" % (client.name, e), ERROR)
+            writer.close()
 
-        self.txQueue.put(decoded_data, block=False)
+    def queue_frame(self, frame, client):
+        logf("Received from "+client.name+" KISS Frame: "+repr(frame))
+        try:
+            kissType, offset = KissHelper.kiss_type(frame)
+            if kissType != KISS_CMD_DATA:
+                # commands and data for other ports are never queued for TX
+                self.kiss_command(kissType, KissHelper.kiss_unescape(frame[offset:-1]), client)
+                return
+            if config.TX_OE_Style:
+                decoded_data = KissHelper.decode_kiss_OE(frame)
+            else:
+                decoded_data = KissHelper.decode_kiss_AX25(frame)
+        except (IndexError, ValueError) as e:
+            # truncated or malformed frame, the client stays connected
+            logf("KISS-Server: invalid KISS frame from "+client.name+": "+repr(e), ERROR)
+            decoded_data = None
+        #logf("Decapsulated Kiss Frame :"+ repr(decoded_data))
+        if decoded_data is None:
+            client.invalid += 1
+            return
+        client.frames_in += 1
+        if self.scheduler and log_enabled(DEBUG):
+            logf("KISS-Server: TX expected in %.1fs" % self.scheduler.queue_wait(), DEBUG)
+        # frame timestamp is used by the TX scheduler for latency measurement
+        self.txQueue.put(Frame(decoded_data, Frame.TX, config.TX_OE_Style), block=False)
 
-    def __del__(self):
-        self.socket.shutdown()
+    def kiss_command(self, kissType, value, client):
+        if kissType == KISS_CMD_RETURN:
+            logf("KISS-Server: "+client.name+" sent KISS return, ignored")
+            return
+        port = kissType >> 4
+        command = kissType & 0x0F
+        if command == KISS_CMD_DATA:
+            logf("KISS-Server: data frame from "+client.name+" for port "+str(port)+" discarded, only port 0 is available", ERROR)
+            client.invalid += 1
+            return
+        client.commands += 1
+        if command == KISS_CMD_SETHARDWARE:
+            logf("KISS-Server: SetHardware from "+client.name+" not supported, ignored: "+repr(value))
+            return
+        if command == KISS_CMD_TXTAIL:
+            logf("KISS-Server: TXTAIL from "+client.name+" is obsolete, ignored")
+            return
+        if not value:
+            logf("KISS-Server: command "+str(command)+" from "+client.name+" without value, ignored", ERROR)
+            return
+        scheduler = self.scheduler
+        if scheduler is None:
+            logf("KISS-Server: command "+str(command)+" from "+client.name+" received before TX start, ignored", ERROR)
+            return
+        value = value[0]
+        if command == KISS_CMD_TXDELAY:
+            scheduler.configure(txDelay=value / 100)
+            logf("KISS-Server: TXDELAY set to %ims by %s" % (value * 10, client.name))
+        elif command == KISS_CMD_P:
+            scheduler.configure(persistence=value)
+            logf("KISS-Server: persistence set to %i by %s" % (value, client.name))
+        elif command == KISS_CMD_SLOTTIME:
+            scheduler.configure(slotTime=value / 100)
+            logf("KISS-Server: SLOTTIME set to %ims by %s" % (value * 10, client.name))
+        elif command == KISS_CMD_FULLDUPLEX:
+            scheduler.configure(fullDuplex=value != 0)
+            logf("KISS-Server: %s duplex set by %s" % ("full" if value else "half", client.name))
+        else:
+            logf("KISS-Server: unknown command "+str(command)+" from "+client.name+", ignored", ERROR)
 
-    def send(self, data,signalreport):
-        global peer
-        LORA_APRS_HEADER = b"<\xff\x01"
-        # remove LoRa-APRS header if present
-        if data[0:len(LORA_APRS_HEADER)] == LORA_APRS_HEADER:
-            data = data[len(LORA_APRS_HEADER):]
-            logf("\033[95mOE_Style header found!\033[0m")
+    def send(self, frame): #frame is a Frame received from radio, called from the radio thread
+        # LoRa-APRS header was recognized and removed when the frame was received
+        if frame.oe:
+            logf("\033[95mOE_Style header found!\033[0m", DEBUG)
             try:
-                encoded_data = KissHelper.encode_kiss_OE(data,signalreport)
+                encoded_data = KissHelper.encode_kiss_OE(frame)
             except Exception as e:
-                logf("KISS encoding went wrong (exception while parsing)")
+                logf("KISS encoding went wrong (exception while parsing)", ERROR)
                 traceback.print_tb(e.__traceback__)
                 encoded_data = None
         else:
-            logf("\033[94mNo OE_Style header found, trying standard AX25 decoding...\033[0m")
+            logf("\033[94mNo OE_Style header found, trying standard AX25 decoding...\033[0m", DEBUG)
             try:
-                encoded_data = KissHelper.encode_kiss_AX25(data,signalreport)
+                encoded_data = KissHelper.encode_kiss_AX25(frame)
             except Exception as e:
-                logf("KISS encoding went wrong (exception while parsing)")
+                logf("KISS encoding went wrong (exception while parsing)", ERROR)
                 traceback.print_tb(e.__traceback__)
                 encoded_data = None
         if encoded_data != None:
-            if self.connection:
-                logf("Sending to ip: " + client_address[0] + " port:" + str(client_address[1]) + " Frame: " + repr(encoded_data))
-                self.connection.sendall(encoded_data)
+            # frame is encoded once and written to every client by the network loop
+            self.loop.call_soon_threadsafe(self.broadcast, bytes(encoded_data))
         else:
-            logf("KISS encoding went wrong")
+            logf("KISS encoding went wrong", ERROR)
+
+    def broadcast(self, data): #runs in the network loop, never waits for a client
+        for client in self.clients:
+            if client.writer.is_closing():
+                continue
+            if len(client.queue) >= self.clientQueueSize:
+                client.dropped += 1
+                if self.dropPolicy == DROP_NEWEST:
+                    logf("KISS-Server: queue of " + client.name + " full, frame dropped", DEBUG)
+                    continue
+                if self.dropPolicy == DROP_DISCONNECT and not client.persistent:
+                    logf("KISS-Server: queue of " + client.name + " full, closing connection", ERROR)
+                    client.writer.transport.abort()
+                    continue
+                logf("KISS-Server: queue of " + client.name + " full, oldest frame dropped", DEBUG)
+                client.queue.popleft()
+            logf("Sending to " + client.name + " Frame: " + repr(data), DEBUG)
+            client.queue.append(data)
+            client.ready.set()
+
+    def stats(self): #counters of connected clients
+        return [client.stats() for client in list(self.clients)]
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
 
+def benchmark_latency(host, port, transport="tcp", frames=500, burst=4):
+    '''RX->client latency on loopback: time from send() in the radio thread to complete reception by a client
+    connected with transport "tcp", "unix" or "pty"'''
+    from queue import Queue
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    unixPath = os.path.join(tmp, "kiss.sock") if transport == "unix" else ""
+    ptyLink = os.path.join(tmp, "kiss-pty") if transport == "pty" else ""
+    server = KissServer(Queue(), host, port, unixPath, ptyLink)
+    server.daemon = True
+    server.start()
+    if transport == "pty":
+        fd = os.open(ptyLink, os.O_RDWR | os.O_NOCTTY)
+        receive = lambda: os.read(fd, 65536)
+    else:
+        if transport == "unix":
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(unixPath)
+        else:
+            client = socket.create_connection((host, port))
+        apply_socket_options(client)
+        receive = lambda: client.recv(65536)
+    time.sleep(0.1)
+    frame = Frame.fromRadio(b'<\xff\x01IZ7BOJ-12>APRS,WIDE1-1:!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V', -115, 0, 0)
+    length = len(KissHelper.encode_kiss_OE(frame))
+    results = []
+    for count in (1, burst): # single frames and bursts of frames sent back to back
+        samples = []
+        for i in range(frames):
+            t = time.perf_counter()
+            for j in range(count):
+                server.send(frame)
+            received = 0
+            while received < length * count:
+                received += len(receive())
+            samples.append(time.perf_counter() - t)
+        samples.sort()
+        results.append((count, samples[len(samples) // 2], samples[len(samples) * 99 // 100]))
+    if transport == "pty":
+        os.close(fd)
+    else:
+        client.close()
+    server.stop()
+    server.join()
+    server.socket.close()
+    os.rmdir(tmp)
+    return results
 
 if __name__ == '__main__':
     '''Test program'''
     import time
-    from multiprocessing import Queue
+    from queue import Queue
 
-    TCP_HOST = "0.0.0.0"
+    TCP_HOST = "127.0.0.1"
     TCP_PORT = 10001
 
+    if sys.argv[1:] == ["benchmark"]:
+        # python3 TCPServer.py benchmark
+        import Logger
+        Logger.set_level(Logger.WARNING)
+        port = TCP_PORT
+        for nodelay in (False, True):
+            for buf in (0, 4096):
+                config.KISS_TCP_NODELAY = nodelay
+                config.KISS_SNDBUF = config.KISS_RCVBUF = buf
+                port += 1
+                for count, p50, p99 in benchmark_latency(TCP_HOST, port):
+                    print("TCP_NODELAY=%-5s SNDBUF/RCVBUF=%-7s burst=%i  p50 %7.1f us  p99 %7.1f us" %
+                          (nodelay, buf or "default", count, p50 * 1e6, p99 * 1e6))
+        # transports compared with default socket options
+        config.KISS_TCP_NODELAY = True
+        config.KISS_SNDBUF = config.KISS_RCVBUF = 0
+        for transport in ("tcp", "unix", "pty"):
+            port += 1
+            for count, p50, p99 in benchmark_latency(TCP_HOST, port, transport):
+                print("transport=%-4s burst=%i  p50 %7.1f us  p99 %7.1f us" % (transport, count, p50 * 1e6, p99 * 1e6))
+        sys.exit(0)
+
     # frames to be sent go here
     KissQueue = Queue()
 
     server = KissServer(KissQueue,TCP_HOST, TCP_PORT)
-    server.setDaemon(True)
+    server.daemon = True
     server.start()
 
-    #server.send(b"\xc0\x00\x82\xa0\xa4\xa6@@`\x9e\x8ar\xa8\x96\x90q\x03\xf0!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V\xc0",{"level":0, "snr":0},'Level:-115dBm, SNR:0dB')
-    server.send(b'<\xff\x01IZ7BOJ-12>APRS::OE1ACM-29: No GPS-Fix  Batt=0.00V {19','Level:-115dBm, SNR:0dB')
-    data = KissQueue.get()
-    print("Received KISS frame:" + repr(data))
+    # two clients connected at the same time, both receive frames from radio
+    clients = [socket.create_connection((TCP_HOST, TCP_PORT)) for i in range(2)]
+    time.sleep(0.1)
+    #server.send(Frame.fromRadio(b"\x82\xa0\xa4\xa6@@`\x9e\x8ar\xa8\x96\x90q\x03\xf0!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V", -115, 0, 0))
+    server.send(Frame.fromRadio(b'<\xff\x01IZ7BOJ-12>APRS::OE1ACM-29: No GPS-Fix  Batt=0.00V {19', -115, 0, 0))
+    for client in clients:
+        print("Client received KISS frame:" + repr(client.recv(config.KISS_RECV_SIZE)))
+
+    # frame from the second client goes to the TX queue, split in two packets
+    kissframe = b"\xc0\x00\x82\xa0\xa4\xa6@@`\x9e\x8ar\xa8\x96\x90p\x88\x92\x8e\x92@@f\x88\x92\x8e\x92@@e\x03\xf0!4725.51N/00939.86E[322/002/A=001306 Batt=3.99V\xc0"
+    clients[1].sendall(kissframe[:20])
+    clients[1].sendall(kissframe[20:])
+    print("Queued for TX:" + repr(KissQueue.get(timeout=1)))
+
+    # a client that never reads: radio frames are dropped for it, the radio thread is never blocked
+    stalled = socket.create_connection((TCP_HOST, TCP_PORT))
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    time.sleep(0.1)
+    frame = Frame.fromRadio(b'<\xff\x01IZ7BOJ-12>APRS:>' + b"x" * 200, -115, 0, 0)
+    t = time.perf_counter()
+    for i in range(2000):
+        server.send(frame)
+    print("send() of 2000 frames with a stalled client: %.1fms" % ((time.perf_counter() - t) * 1000))
+    time.sleep(0.5)
+
+    clients[0].close()
+    time.sleep(0.1)
+    print(server.stats())
+    server.stop()
+    server.join()
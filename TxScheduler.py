@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# TX scheduler shared by the SX126x and SX127x TNCs.
+# Frames queued by the KISS server are sent as soon as they are dequeued and
+# the channel is clear, so digipeat latency is bounded by airtime and not by
+# a polling period.
+# Channel access follows KISS p-persistence: TXDELAY, P, SLOTTIME and FULLDUPLEX
+# start from config.py and can be changed at runtime with configure().
+# When the channel is busy (TNC channel_busy(), CAD on the radio), access is retried
+# after a random backoff of 1 to CSMA_BACKOFF slots.
+# Queue items are Frame objects, their timestamp is the KISS reception time.
+# The time on air of each frame is known in advance (Airtime.py), it gives the
+# TX timeout, the queue wait estimate and the channel utilisation counters.
+# With config.DUTY_CYCLE set, each frame is charged its time on air to a token
+# bucket, frames over budget are deferred or dropped (config.DUTY_CYCLE_POLICY).
+
+import time
+import random
+import traceback
+from threading import Thread
+from queue import Empty
+from Airtime import Airtime, ChannelMeter, DutyCycle
+from Logger import logf, DEBUG, WARNING, ERROR
+import config
+
+class TxScheduler(Thread):
+    '''Thread blocking on the KISS TX queue and transmitting frames when the channel is clear'''
+
+    QUEUE_TIMEOUT = 1.0   # max blocking time on the queue, in seconds, so that stop() is noticed
+
+    def __init__(self, queue, transmit, channel_busy, airtime=None):
+        # transmit(frame) sends the frame and returns when TX is finished
+        # channel_busy() returns True if a signal is detected on the channel
+        # airtime is the Airtime of the radio modulation, config.py modulation if None
+        Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.transmit = transmit
+        self.channel_busy = channel_busy
+        self.running = True
+        # channel access parameters, times in seconds
+        self.txDelay = config.TX_DELAY / 1000
+        self.persistence = config.PERSISTENCE
+        self.slotTime = config.SLOT_TIME / 1000
+        self.fullDuplex = config.FULL_DUPLEX
+        self.backoff = config.CSMA_BACKOFF
+        self.deferred = 0  # slots waited because of p-persistence
+        self.busy = 0      # channel found busy, each one a collision if the frame had been sent
+        self.retries = 0   # channel checks repeated after busy channel or p-persistence, so busy + deferred
+        self.errors = 0    # frames not sent because of an exception
+        self.airtime = Airtime() if airtime is None else airtime
+        self.channel = ChannelMeter()
+        self.dutyCycle = DutyCycle()
+        self.txEnd = 0.0   # expected end of current or last TX, monotonic time
+        # latency from KISS enqueue to TX start, in seconds
+        self.tx_count = 0
+        self.latency_last = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def run(self):
+        while self.running:
+            try:
+                frame = self.queue.get(timeout=self.QUEUE_TIMEOUT)
+            except Empty:
+                continue
+            # an SPI/GPIO error or a bad frame must not stop the scheduler
+            try:
+                self.send(frame)
+            except Exception as e:
+                self.errors += 1
+                logf("TX scheduler: exception while sending " + repr(frame) + ": " + repr(e), ERROR)
+                traceback.print_tb(e.__traceback__)
+
+    def send(self, frame):
+        airtime = self.airtime(len(frame.onAir()))
+        if not self.wait_duty_cycle(airtime):
+            return
+        self.access_channel()
+        if self.txDelay:
+            time.sleep(self.txDelay)
+        frame.sent = time.monotonic()
+        self.dutyCycle.charge(airtime, frame.sent)
+        self.txEnd = frame.sent + airtime
+        self.channel.add_tx(airtime, frame.sent)
+        latency = frame.latency
+        self.tx_count += 1
+        self.latency_last = latency
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.transmit(frame)
+
+    def wait_duty_cycle(self, airtime): #returns False if the frame must be dropped
+        dutyCycle = self.dutyCycle
+        wait = dutyCycle.wait(airtime)
+        if not wait:
+            return True
+        if dutyCycle.policy == DutyCycle.DROP or not dutyCycle.fits(airtime):
+            dutyCycle.dropped += 1
+            logf("Duty cycle: TX budget %.2fs, frame of %.2fs dropped" % (dutyCycle.budget(), airtime), WARNING)
+            return False
+        dutyCycle.deferred += 1
+        logf("Duty cycle: TX budget %.2fs, frame of %.2fs deferred by %.1fs" % (dutyCycle.budget(), airtime, wait), WARNING)
+        while wait and self.running:
+            time.sleep(min(wait, self.QUEUE_TIMEOUT))
+            wait = dutyCycle.wait(airtime)
+        return self.running
+
+    def access_channel(self): #returns when the frame can be transmitted
+        if self.fullDuplex:
+            return
+        while True:
+            # only transmit if no signal is detected to avoid collisions
+            if self.channel_busy():
+                # random backoff, so that stations waiting for the same frame don't transmit together
+                self.busy += 1
+                wait = random.randint(1, max(self.backoff, 1)) * self.slotTime
+            elif self.persistence >= 255 or random.randrange(256) <= self.persistence:
+                return
+            else:
+                self.deferred += 1
+                wait = self.slotTime
+            # channel is checked again after the wait
+            self.retries += 1
+            time.sleep(wait)
+
+    def received(self, payloadLength):
+        # called by the TNC for each received frame
+        self.channel.add_rx(self.airtime(payloadLength))
+
+    def queue_wait(self):
+        # estimated time before a frame queued now starts TX, in second. Channel access delays are not included
+        with self.queue.mutex:
+            lengths = [len(frame.onAir()) for frame in self.queue.queue]
+        wait = max(self.txEnd - time.monotonic(), 0.0)
+        airtime = 0.0
+        for length in lengths:
+            wait += self.txDelay + self.airtime(length)
+            airtime += self.airtime(length)
+        # queued frames can't start before the duty cycle budget covers them
+        return max(wait, self.dutyCycle.wait(airtime)) + self.txDelay
+
+    def configure(self, txDelay=None, persistence=None, slotTime=None, fullDuplex=None, backoff=None):
+        # called from other threads, e.g. on KISS commands. Times in seconds, backoff in slots
+        if txDelay is not None:
+            self.txDelay = txDelay
+        if persistence is not None:
+            self.persistence = persistence
+        if slotTime is not None:
+            self.slotTime = slotTime
+        if fullDuplex is not None:
+            self.fullDuplex = fullDuplex
+        if backoff is not None:
+            self.backoff = backoff
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return dict(
+                tx_count     = self.tx_count,
+                latency_last = self.latency_last,
+                latency_avg  = self.latency_sum / self.tx_count if self.tx_count else 0.0,
+                latency_max  = self.latency_max,
+                deferred     = self.deferred,
+                errors       = self.errors,
+                busy         = self.busy,
+                retries      = self.retries,
+                backoff      = self.backoff,
+                tx_delay     = self.txDelay,
+                persistence  = self.persistence,
+                slot_time    = self.slotTime,
+                full_duplex  = self.fullDuplex,
+                queue_wait   = self.queue_wait(),
+                utilisation  = self.channel.utilisation(),
+                duty_cycle   = self.dutyCycle.stats()
+            )
@@ -21,8 +21,7 @@
 # <http://www.gnu.org/licenses/>.
 
 
-import RPi.GPIO as GPIO
-import spidev
+from Hardware import gpio as GPIO, SpiDev
 import config
 import time
 
@@ -65,7 +64,7 @@ class BOARD:
         :param spi_cs: The RPi SPI chip select to use: 0 or 1
         :rtype: SpiDev
         """
-        BOARD.spi = spidev.SpiDev()
+        BOARD.spi = SpiDev()
         BOARD.spi.open(spi_bus, spi_cs)
         BOARD.spi.max_speed_hz = 5000000    # SX127x can go up to 10MHz, pick half that to be safe
         return BOARD.spi
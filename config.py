@@ -10,6 +10,11 @@ font_size = 8
 ## Log enable and path
 log_enable = True
 logpath='/var/log/lora/lora.log' #log filename. Give r/w permission!
+log_level = "INFO" #DEBUG, INFO, WARNING or ERROR. DEBUG shows per-frame parsing details
+log_flush_lines = 20 #log lines are written to file in batches of this size...
+log_flush_interval = 1.0 #...or after this time in seconds
+log_max_size = 1000000 #log file is rotated when bigger than this size in bytes. 0 disables rotation
+log_backup_count = 3 #number of rotated log files kept (lora.log.1, lora.log.2...)
 
 ## KISS Settings
 # Where to listen?
@@ -17,8 +22,38 @@ logpath='/var/log/lora/lora.log' #log filename. Give r/w permission!
 # TCP_PORT as configured in aprx.conf <interface> section
 TCP_HOST = "0.0.0.0"
 TCP_PORT = 10001
+# Additional KISS endpoints for programs on the same host, served together with TCP. Leave empty to disable
+KISS_UNIX_SOCKET = "" #path of an unix domain stream socket, es. "/tmp/lora-kiss.sock"
+KISS_PTY_LINK = "" #path of a symlink to a pseudo terminal, for programs that only open serial KISS devices, es. "/tmp/lora-kiss-pty"
+# Frames received from radio wait in a queue for each KISS client, so that a slow client never blocks reception
+KISS_CLIENT_QUEUE = 64 #max frames waiting to be sent to each client
+KISS_DROP_POLICY = "oldest" #when a client queue is full: "oldest" drops the oldest frame, "newest" drops the new frame, "disconnect" closes the client
+# Socket options of KISS server and client connections
+KISS_TCP_NODELAY = True #disables Nagle algorithm, small KISS frames are sent without waiting for ACKs of previous data
+KISS_SNDBUF = 0 #socket send buffer size in bytes, 0 keeps the system default
+KISS_RCVBUF = 0 #socket receive buffer size in bytes, 0 keeps the system default
+KISS_RECV_SIZE = 1024 #max bytes read from a client at once
+KISS_KEEPALIVE = True #TCP keepalive probes detect clients that disappeared without closing the connection
+KISS_KEEPALIVE_IDLE = 60 #idle time in seconds before the first probe
+KISS_KEEPALIVE_INTERVAL = 10 #time in seconds between probes
+KISS_KEEPALIVE_COUNT = 3 #unanswered probes before the connection is closed
+
+## Channel access. KISS clients can change these values at runtime with TXDELAY, P, SLOTTIME and FULLDUPLEX commands
+TX_DELAY = 0 #delay in ms between channel access and TX start. LoRa preamble already gives receivers time to sync, so 0 is fine
+PERSISTENCE = 255 #p-persistence 0..255: when the channel is clear, TX starts with probability (PERSISTENCE+1)/256, otherwise TNC waits one slot. 255 transmits at once
+SLOT_TIME = 100 #slot time in ms, waited when TX is deferred by p-persistence
+FULL_DUPLEX = False #if True, TX starts without checking the channel
+CAD = True #channel is sensed with LoRa Channel Activity Detection before TX, otherwise only a frame being received makes it busy
+CAD_SYMBOLS = 2 #SX126x only, symbols listened by CAD: 1, 2, 4, 8 or 16. More symbols detect weaker signals but take longer
+CSMA_BACKOFF = 8 #when the channel is busy, access is retried after a random number of slots between 1 and CSMA_BACKOFF
+
+## Duty cycle. TX time on air is charged to a budget refilled at DUTY_CYCLE percent, e.g. 1 or 10 in EU 868MHz sub-bands
+DUTY_CYCLE = 0 #max percentage of time on air, 0 disables the limit
+DUTY_CYCLE_WINDOW = 3600 #averaging period in seconds. The budget holds at most DUTY_CYCLE% of it, so bursts up to that airtime are sent at once
+DUTY_CYCLE_POLICY = "defer" #frame over budget: "defer" waits until the budget allows it, "drop" discards it
 
 ## Hardware Settings
+hardware = "rpi" #"rpi" drives the radio with SPI and GPIO of the Raspberry Pi, "sim" uses the simulated radio of Simulator.py (no Pi needed)
 # See datasheets for detailed pinout.
 # The default pin assignment refers to PCB designed by I8FUC.
 # The user can wire the module by his own and change pin assignment.